@@ -7,7 +7,6 @@ Event-driven USB detection with proper permission handling
 import os
 import sys
 import signal
-import time
 import threading
 from pathlib import Path
 
@@ -18,7 +17,7 @@ from utils import log_message
 from config import WEB_PORT, DEFAULT_VOLUME
 from usb_monitor import USBMonitor
 from player import MusicPlayer
-from web_interface import create_app
+from web_interface import create_app, run_server
 
 class USBMusicPlayerApp:
     def __init__(self):
@@ -66,9 +65,9 @@ class USBMusicPlayerApp:
             log_message("⚡ Using event-driven USB detection (no polling!)")
             log_message("🛑 Press Ctrl+C to stop")
             
-            # Main loop - just wait for signals
+            # Main loop - sleep until a signal arrives instead of waking every second
             while self.running:
-                time.sleep(1)
+                signal.pause()
                 
         except KeyboardInterrupt:
             log_message("Received keyboard interrupt")
@@ -108,13 +107,7 @@ class USBMusicPlayerApp:
         """Run the web server in a separate thread"""
         try:
             log_message(f"Starting web server on port {WEB_PORT}")
-            self.web_app.run(
-                host='0.0.0.0',
-                port=WEB_PORT,
-                debug=False,
-                use_reloader=False,
-                threaded=True
-            )
+            run_server(self.web_app, WEB_PORT)
         except Exception as e:
             log_message(f"Error running web server: {e}")
             
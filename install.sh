@@ -182,7 +182,7 @@ if [ "$DEPLOYMENT_METHOD" = "native" ]; then
     
     print_status "Installing Python dependencies..."
     pip install --upgrade pip
-    pip install flask werkzeug flask-cors python-vlc mutagen
+    pip install flask werkzeug flask-cors python-vlc mutagen waitress
     
     print_status "Python environment ready"
 else
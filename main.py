@@ -13,7 +13,7 @@ from config import WEB_PORT
 from utils import log_message
 from music_player import MusicPlayer
 from usb_monitor import USBMonitor
-from web_interface import create_app
+from web_interface import create_app, run_server
 
 # Global references for cleanup
 music_player = None
@@ -90,13 +90,7 @@ def main():
         log_message(f"Web interface available at: http://localhost:{WEB_PORT}")
         
         # Run the Flask app
-        web_app.run(
-            host='0.0.0.0',
-            port=WEB_PORT,
-            debug=False,
-            threaded=True,
-            use_reloader=False  # Disable reloader to avoid double startup
-        )
+        run_server(web_app, WEB_PORT)
         
     except KeyboardInterrupt:
         log_message("Received keyboard interrupt")
@@ -138,7 +138,7 @@ source venv/bin/activate
 
 print_status "Installing Python dependencies..."
 pip install --upgrade pip
-pip install flask werkzeug flask-cors python-vlc mutagen
+pip install flask werkzeug flask-cors python-vlc mutagen waitress
 
 print_status "✅ Python environment ready"
 
@@ -5,7 +5,7 @@ import os
 import time
 import pygame
 import threading
-from utils import log_message, find_music_usb, find_control_usb_with_retry, usb_is_mounted, find_album_folder
+from utils import log_message, find_music_usb, find_control_usb_with_retry, usb_is_mounted, find_album_folder, AUDIO_EXTENSIONS
 from config import CONTROL_FILE_NAME, AUDIO_OUTPUT, VOLUME_LEVEL
 
 class MusicController:
@@ -109,7 +109,7 @@ class MusicController:
             return False
         
         # Find album folder
-        album_folder = find_album_folder(album_name)
+        album_folder = find_album_folder(album_name, music_usb_path)
         if not album_folder:
             log_message(f"Album folder not found: {album_name}")
             return False
@@ -130,11 +130,10 @@ class MusicController:
     def load_tracks_from_folder(self, folder_path):
         """Load all music files from a folder."""
         tracks = []
-        supported_formats = ('.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg')
         
         try:
             for file in sorted(os.listdir(folder_path)):
-                if file.lower().endswith(supported_formats):
+                if os.path.splitext(file)[1].lower() in AUDIO_EXTENSIONS:
                     full_path = os.path.join(folder_path, file)
                     tracks.append(full_path)
             
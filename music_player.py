@@ -6,18 +6,71 @@ Replaces the pygame-based player with a more robust VLC implementation
 
 import os
 import time
-import glob
 import threading
-from urllib.parse import unquote
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
 import vlc
-from utils import log_message, find_album_folder
+from utils import log_message, find_album_folder, format_track_name, music_index, AUDIO_EXTENSIONS
 from config import CONTROL_FILE_NAME, VOLUME_LEVEL, repeat_playback
 
+# Bytes of each track to pre-read into the page cache when an album is loaded
+PREFETCH_BYTES = 128 * 1024
+
+# Seconds a playback position/length reading is reused across web polls
+PLAYBACK_INFO_TTL = 0.5
+
+# Volume changes within this many seconds are coalesced into one libvlc call
+VOLUME_DEBOUNCE = 0.05
+
+# Per-media options: local files need far less read-ahead than the instance default
+MEDIA_OPTIONS = (':no-video', ':file-caching=300')
+
+# Recently played vlc.Media objects kept for repeats and next/previous
+MEDIA_CACHE_SIZE = 8
+
+# Upper bound on a control file read; commands are a single short line
+CONTROL_FILE_MAX_BYTES = 4096
+
+@dataclass(frozen=True)
+class AlbumState:
+    """Immutable snapshot of the loaded album.
+
+    The player rebinds a new instance on every album change, so readers on
+    other threads (e.g. Flask handlers) always see a consistent name/folder/
+    tracks triple without taking a lock.
+    """
+    album: Optional[str] = None
+    folder: Optional[str] = None
+    tracks: Tuple[str, ...] = ()
+    # Display names for tracks, formatted once when the album is loaded
+    track_names: Tuple[str, ...] = ()
+
+    @classmethod
+    def load(cls, album, folder, tracks):
+        """Build a snapshot for tracks, precomputing their display names"""
+        tracks = tuple(tracks)
+        return cls(album, folder, tracks, tuple(format_track_name(t) for t in tracks))
+
+@dataclass(frozen=True)
+class PlayerSnapshot:
+    """Playback state read in one pass under the player lock."""
+    album_state: AlbumState
+    track_path: Optional[str]
+    track_title: Optional[str]
+    is_playing: bool
+    volume: int
+    position: int
+    length: int
+
 class MusicPlayer:
     """VLC-based music player with event-driven USB support"""
     
     def __init__(self):
         """Initialize the music player"""
+        # Serializes libvlc state transitions between the web, control and VLC threads
+        self._lock = threading.RLock()
+        
         try:
             # Create VLC instance with optimized audio settings for Raspberry Pi
             vlc_args = [
@@ -40,15 +93,24 @@ class MusicPlayer:
             self.media_player = self.vlc_instance.media_player_new()
             
             # Player state
-            self.current_album = None
-            self.current_album_folder = None
-            self.current_album_tracks = []
+            self.album_state = AlbumState()
             self.current_track_index = 0
             self.current_track_path = None
+            self.current_track_title = None
             self.volume = VOLUME_LEVEL
             self.repeat_mode = repeat_playback
             self.single_track_mode = False  # For single track repeat
             
+            # Cached (monotonic time, info) from get_playback_info
+            self._playback_info_cache = (0.0, None)
+            # Length of the current track in ms, fixed once VLC reports it
+            self._track_length = 0
+            # path -> vlc.Media for recently played tracks, oldest first
+            self._media_cache = OrderedDict()
+            
+            # Pending debounced volume change
+            self._volume_timer = None
+            
             # USB sources
             self.music_source = None
             self.control_source = None
@@ -71,6 +133,18 @@ class MusicPlayer:
             log_message(f"Error initializing VLC player: {str(e)}")
             raise
     
+    @property
+    def current_album(self):
+        return self.album_state.album
+    
+    @property
+    def current_album_folder(self):
+        return self.album_state.folder
+    
+    @property
+    def current_album_tracks(self):
+        return self.album_state.tracks
+    
     def set_music_source(self, music_path):
         """Set the music USB source path"""
         if music_path != self.music_source:
@@ -79,13 +153,17 @@ class MusicPlayer:
             
             if music_path:
                 log_message(f"Music source set to: {music_path}")
+                # Index albums and tracks once per mount, off the USB event thread;
+                # lookups made before it finishes wait for it
+                music_index.build_async(music_path)
                 # Don't auto-start playback, wait for control commands
             else:
                 log_message("Music source disconnected")
+                music_index.clear()
                 self.stop_playback()
-                self.current_album = None
-                self.current_album_folder = None
-                self.current_album_tracks = []
+                self.album_state = AlbumState()
+                with self._lock:
+                    self._media_cache.clear()
     
     def set_control_source(self, control_path):
         """Set the control USB source path"""
@@ -128,17 +206,24 @@ class MusicPlayer:
     
     def _control_monitor_loop(self):
         """Control file monitoring loop"""
+        control_source = control_file_path = None
         while self.control_monitor_running and self.control_source:
             try:
-                control_file_path = os.path.join(self.control_source, CONTROL_FILE_NAME)
+                # Only rebuild the path when the control source changes
+                if self.control_source != control_source:
+                    control_source = self.control_source
+                    control_file_path = os.path.join(control_source, CONTROL_FILE_NAME)
                 
-                if os.path.exists(control_file_path):
-                    # Check if file was modified
-                    current_mtime = os.path.getmtime(control_file_path)
+                # One stat both checks for the file and gets its mtime
+                try:
+                    current_mtime = os.stat(control_file_path).st_mtime
+                except FileNotFoundError:
+                    current_mtime = None
                     
-                    if current_mtime > self.control_file_last_modified:
-                        self.control_file_last_modified = current_mtime
-                        self._process_control_file(control_file_path)
+                # Check if file was modified
+                if current_mtime is not None and current_mtime > self.control_file_last_modified:
+                    self.control_file_last_modified = current_mtime
+                    self._process_control_file(control_file_path)
                 
                 time.sleep(1)  # Check every second
                 
@@ -149,8 +234,7 @@ class MusicPlayer:
     def _process_control_file(self, control_file_path):
         """Process control file commands"""
         try:
-            with open(control_file_path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
+            content = self._read_control_file(control_file_path)
             
             if not content:
                 return
@@ -186,6 +270,23 @@ class MusicPlayer:
         except Exception as e:
             log_message(f"Error processing control file: {str(e)}")
     
+    def _read_control_file(self, control_file_path, attempts=3, delay=0.1):
+        """Read the control file, retrying briefly on transient I/O errors"""
+        for attempt in range(attempts):
+            try:
+                fd = os.open(control_file_path, os.O_RDONLY)
+                try:
+                    data = os.read(fd, CONTROL_FILE_MAX_BYTES)
+                finally:
+                    os.close(fd)
+                return data.decode('utf-8', 'replace').strip()
+            except FileNotFoundError:
+                raise
+            except OSError:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(delay * (attempt + 1))
+    
     def _process_existing_control_file(self):
         """Process existing control file immediately when control source is set"""
         if not self.control_source:
@@ -211,31 +312,55 @@ class MusicPlayer:
             log_message("No music source available")
             return False
         
+        # Re-inserting the same control card shouldn't restart the album
+        if album_name == self.album_state.album and self._album_is_playing():
+            log_message(f"Already playing album '{album_name}'")
+            return True
+        
         # Find album folder
+        music_index.ensure(self.music_source)
         album_folder = find_album_folder(album_name, self.music_source)
         if not album_folder:
             log_message(f"Album not found: {album_name}")
             return False
         
+        # A different name may still resolve to the album that is playing
+        if album_folder == self.album_state.folder and self._album_is_playing():
+            log_message(f"Already playing album '{album_name}'")
+            return True
+        
+        # The album is loaded but stopped: restart it without rescanning the folder
+        with self._lock:
+            if (album_folder == self.album_state.folder and self.album_state.tracks
+                    and not self.single_track_mode):
+                log_message(f"Restarting album '{self.album_state.album}' without rescan")
+                return self._play_track_at_index(0)
+        
         # Load tracks from album
         tracks = self._load_tracks_from_folder(album_folder)
         if not tracks:
             log_message(f"No tracks found in album: {album_name}")
             return False
         
-        # Set current album
-        self.current_album = album_name
-        self.current_album_folder = album_folder
-        self.current_album_tracks = tracks
-        self.current_track_index = 0
-        
-        # Disable single track mode for album playback
-        self.single_track_mode = False
+        # Warm the page cache so track changes don't stall on slow USB media
+        self._prefetch_tracks(tracks)
         
-        log_message(f"Playing album '{album_name}' with {len(tracks)} tracks")
-        
-        # Start playing first track
-        return self._play_track_at_index(0)
+        with self._lock:
+            # Set current album
+            self.album_state = AlbumState.load(album_name, album_folder, tracks)
+            self.current_track_index = 0
+            
+            # Disable single track mode for album playback
+            self.single_track_mode = False
+            
+            log_message(f"Playing album '{album_name}' with {len(tracks)} tracks")
+            
+            # Start playing first track
+            return self._play_track_at_index(0)
+    
+    def _album_is_playing(self):
+        """True while album (not single track) playback is running"""
+        return not self.single_track_mode and self.is_playing()
     
     def play_track_by_name(self, track_name):
         """Play a specific track by name - implements single track repeat"""
@@ -252,17 +377,25 @@ class MusicPlayer:
         
         # Play first matching track in single-track repeat mode
         track_path = found_tracks[0]
-        self.current_album = f"Single Track: {os.path.basename(track_path)}"
-        self.current_album_folder = os.path.dirname(track_path)
-        self.current_album_tracks = [track_path]  # Only this track
-        self.current_track_index = 0
-        self.current_track_path = track_path
-        
-        # Enable single track repeat mode for specific track requests
-        self.single_track_mode = True
+        if (self.single_track_mode and track_path == self.current_track_path
+                and self.is_playing()):
+            log_message(f"Already playing track: {os.path.basename(track_path)}")
+            return True
         
-        log_message(f"Playing single track on repeat: {os.path.basename(track_path)}")
-        success = self._play_media(track_path)
+        with self._lock:
+            self.album_state = AlbumState.load(
+                f"Single Track: {os.path.basename(track_path)}",
+                os.path.dirname(track_path),
+                (track_path,)  # Only this track
+            )
+            self.current_track_index = 0
+            self.current_track_path = track_path
+            
+            # Enable single track repeat mode for specific track requests
+            self.single_track_mode = True
+            
+            log_message(f"Playing single track on repeat: {os.path.basename(track_path)}")
+            success = self._play_media(track_path)
         
         if success:
             log_message(f"Single track repeat mode enabled for: {track_name}")
@@ -272,30 +405,33 @@ class MusicPlayer:
     def _find_tracks_by_name(self, track_name):
         """Find tracks by name with recursive search"""
         found_tracks = []
-        audio_extensions = ('.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg')
         
         try:
-            # Use os.walk for proper recursive search
-            for root, dirs, files in os.walk(self.music_source):
-                for file in files:
-                    if file.lower().endswith(audio_extensions):
-                        # Skip macOS hidden files and system files
-                        if self._is_valid_audio_file(file):
-                            # Check if track name matches (case insensitive, partial match)
-                            if track_name.lower() in file.lower():
-                                full_path = os.path.join(root, file)
-                                found_tracks.append(full_path)
+            # Search the music index instead of walking the drive
+            music_index.ensure(self.music_source)
+            track_lower = track_name.lower()
+            
+            # Exact, prefix and substring matches rank in that order, so only
+            # widen the search when the narrower lookup finds nothing
+            found_tracks = music_index.find_tracks_exact(track_lower)
+            if not found_tracks:
+                found_tracks = music_index.find_tracks_by_prefix(track_lower)
+            if not found_tracks:
+                for filename, full_path in music_index.tracks():
+                    # Check if track name matches (case insensitive, partial match)
+                    if track_lower in filename:
+                        found_tracks.append(full_path)
             
             # Sort by exact match first, then partial matches
             def match_quality(track_path):
                 filename = os.path.basename(track_path).lower()
-                track_lower = track_name.lower()
+                stem, extension = os.path.splitext(filename)
                 
                 # Exact filename match (highest priority)
-                if filename == track_lower + '.mp3' or filename == track_lower + '.flac':
+                if stem == track_lower and extension in ('.mp3', '.flac'):
                     return 0
                 # Exact match without extension
-                elif os.path.splitext(filename)[0] == track_lower:
+                elif stem == track_lower:
                     return 1
                 # Starts with search term
                 elif filename.startswith(track_lower):
@@ -315,33 +451,22 @@ class MusicPlayer:
     def _load_tracks_from_folder(self, folder_path):
         """Load all music files from a folder recursively"""
         tracks = []
-        audio_extensions = ('.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg')
         
         try:
             # First try non-recursive (just the folder itself)
-            direct_files = []
-            for file in sorted(os.listdir(folder_path)):
-                if file.lower().endswith(audio_extensions):
-                    # Skip macOS hidden files and system files
-                    if self._is_valid_audio_file(file):
-                        full_path = os.path.join(folder_path, file)
-                        direct_files.append(full_path)
-            
-            if direct_files:
+            subfolders = self._scan_audio_entries(folder_path, tracks)
+            
+            if tracks:
                 # If we found files directly in the folder, use those
-                tracks = direct_files
+                tracks.sort()
                 log_message(f"Loaded {len(tracks)} tracks from {folder_path}")
             else:
                 # If no direct files, search recursively
                 log_message(f"No direct files found, searching recursively in {folder_path}")
-                for root, dirs, files in os.walk(folder_path):
-                    for file in sorted(files):
-                        if file.lower().endswith(audio_extensions):
-                            # Skip macOS hidden files and system files
-                            if self._is_valid_audio_file(file):
-                                full_path = os.path.join(root, file)
-                                tracks.append(full_path)
+                while subfolders:
+                    subfolders.extend(self._scan_audio_entries(subfolders.pop(), tracks))
                 
+                tracks.sort()
                 log_message(f"Loaded {len(tracks)} tracks recursively from {folder_path}")
             
         except Exception as e:
@@ -349,6 +474,20 @@ class MusicPlayer:
         
         return tracks
     
+    def _scan_audio_entries(self, folder_path, tracks):
+        """Append audio files in folder_path to tracks and return its subfolders"""
+        subfolders = []
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                # Skip macOS hidden files and system files
+                if not self._is_valid_audio_file(entry.name):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                    tracks.append(entry.path)
+        return subfolders
+    
     def _is_valid_audio_file(self, filename):
         """Check if file is a valid audio file (not system/hidden file)"""
         # Skip macOS resource fork files
@@ -367,74 +506,113 @@ class MusicPlayer:
         # Skip very small files (likely corrupted)
         return True
     
-    def _play_track_at_index(self, index):
-        """Play track at specific index in current album"""
-        if not self.current_album_tracks or index < 0 or index >= len(self.current_album_tracks):
-            log_message(f"Invalid track index: {index}")
-            return False
+    def _prefetch_tracks(self, tracks):
+        """Ask the kernel to read ahead the start of each track in the background"""
+        if not hasattr(os, 'posix_fadvise'):
+            return
         
-        self.current_track_index = index
-        track_path = self.current_album_tracks[index]
-        self.current_track_path = track_path
+        def prefetch():
+            for track_path in tracks:
+                try:
+                    fd = os.open(track_path, os.O_RDONLY)
+                    try:
+                        os.posix_fadvise(fd, 0, PREFETCH_BYTES, os.POSIX_FADV_WILLNEED)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    # Track may have vanished with the USB; playback will report it
+                    continue
         
-        return self._play_media(track_path)
+        threading.Thread(target=prefetch, daemon=True).start()
+    
+    def _play_track_at_index(self, index):
+        """Play track at specific index in current album"""
+        with self._lock:
+            if not self.current_album_tracks or index < 0 or index >= len(self.current_album_tracks):
+                log_message(f"Invalid track index: {index}")
+                return False
+            
+            self.current_track_index = index
+            track_path = self.current_album_tracks[index]
+            self.current_track_path = track_path
+            
+            return self._play_media(track_path)
     
     def _play_media(self, media_path):
         """Play media file using VLC"""
-        try:
-            # Create media object
-            media = self.vlc_instance.media_new(media_path)
-            self.media_player.set_media(media)
+        with self._lock:
+            try:
+                # Position/length of the previous track no longer apply
+                self._playback_info_cache = (0.0, None)
+                self._track_length = 0
+                # Every track change goes through here, so the title is cached once
+                self.current_track_title = os.path.basename(media_path)
             
-            # Start playback
-            result = self.media_player.play()
+                # Create media object; tags are never parsed, so libvlc doesn't
+                # read metadata off the USB stick before playback starts.
+                # Recently played tracks reuse their existing Media object.
+                media = self._media_cache.get(media_path)
+                if media is None:
+                    media = self.vlc_instance.media_new(media_path, *MEDIA_OPTIONS)
+                    self._media_cache[media_path] = media
+                    if len(self._media_cache) > MEDIA_CACHE_SIZE:
+                        self._media_cache.popitem(last=False)
+                else:
+                    self._media_cache.move_to_end(media_path)
+                self.media_player.set_media(media)
             
-            if result == 0:  # Success
-                track_name = os.path.basename(media_path)
-                log_message(f"Now playing: {track_name}")
-                return True
-            else:
-                log_message(f"Failed to play: {media_path}")
-                return False
+                # Start playback
+                result = self.media_player.play()
+            
+                if result == 0:  # Success
+                    track_name = os.path.basename(media_path)
+                    log_message(f"Now playing: {track_name}")
+                    return True
+                else:
+                    log_message(f"Failed to play: {media_path}")
+                    return False
                 
-        except Exception as e:
-            log_message(f"Error playing media {media_path}: {str(e)}")
-            return False
+            except Exception as e:
+                log_message(f"Error playing media {media_path}: {str(e)}")
+                return False
     
     def toggle_play_pause(self):
         """Toggle between play and pause"""
-        if self.is_playing():
-            self.pause_playback()
-        else:
-            self.resume_playback()
+        with self._lock:
+            if self.is_playing():
+                self.pause_playback()
+            else:
+                self.resume_playback()
     
     def pause_playback(self):
         """Pause current playback"""
-        try:
-            self.media_player.pause()
-            log_message("Playback paused")
-        except Exception as e:
-            log_message(f"Error pausing playback: {str(e)}")
+        with self._lock:
+            try:
+                self.media_player.pause()
+                log_message("Playback paused")
+            except Exception as e:
+                log_message(f"Error pausing playback: {str(e)}")
     
     def resume_playback(self):
         """Resume paused playback"""
-        try:
-            if self.media_player.get_state() == vlc.State.Paused:
-                self.media_player.play()
-                log_message("Playback resumed")
-            elif not self.is_playing():
-                # If we have tracks loaded, try to resume from current track
-                if self.current_album_tracks and self.current_track_index >= 0:
-                    log_message("Resuming from current track")
-                    self._play_track_at_index(self.current_track_index)
-                # If no tracks but we have a music source, try to load default album
-                elif self.music_source and os.path.exists(self.music_source):
-                    log_message("No tracks loaded, attempting to load default album from music source")
-                    self._load_default_album()
-                else:
-                    log_message("Cannot resume: No tracks available and no music source")
-        except Exception as e:
-            log_message(f"Error resuming playback: {str(e)}")
+        with self._lock:
+            try:
+                if self.media_player.get_state() == vlc.State.Paused:
+                    self.media_player.play()
+                    log_message("Playback resumed")
+                elif not self.is_playing():
+                    # If we have tracks loaded, try to resume from current track
+                    if self.current_album_tracks and self.current_track_index >= 0:
+                        log_message("Resuming from current track")
+                        self._play_track_at_index(self.current_track_index)
+                    # If no tracks but we have a music source, try to load default album
+                    elif self.music_source and os.path.exists(self.music_source):
+                        log_message("No tracks loaded, attempting to load default album from music source")
+                        self._load_default_album()
+                    else:
+                        log_message("Cannot resume: No tracks available and no music source")
+            except Exception as e:
+                log_message(f"Error resuming playback: {str(e)}")
     
     def _load_default_album(self):
         """Load the first available album from music source"""
@@ -443,24 +621,30 @@ class MusicPlayer:
                 log_message("No valid music source available")
                 return False
             
-            # Look for the first directory with music files
-            for root, dirs, files in os.walk(self.music_source):
-                # Check if this directory has audio files
+            # Look for the first directory with music files, top-down like
+            # os.walk but stopping at the first hit and skipping hidden folders
+            stack = [self.music_source]
+            while stack:
+                root = stack.pop()
                 audio_files = []
-                for file in files:
-                    if file.lower().endswith(('.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg')):
-                        if self._is_valid_audio_file(file):
-                            audio_files.append(os.path.join(root, file))
+                try:
+                    subfolders = self._scan_audio_entries(root, audio_files)
+                except OSError:
+                    continue
+                stack.extend(reversed(subfolders))
                 
                 if audio_files:
                     # Found a directory with music, load it as default
-                    self.current_album = os.path.basename(root) or "Default Album"
-                    self.current_album_folder = root
-                    self.current_album_tracks = sorted(audio_files)
+                    self.album_state = AlbumState.load(
+                        os.path.basename(root) or "Default Album",
+                        root,
+                        sorted(audio_files)
+                    )
                     self.current_track_index = 0
                     self.single_track_mode = False
                     
                     log_message(f"Loaded default album '{self.current_album}' with {len(audio_files)} tracks")
+                    self._prefetch_tracks(self.current_album_tracks)
                     return self._play_track_at_index(0)
             
             log_message("No audio files found in music source")
@@ -472,59 +656,75 @@ class MusicPlayer:
     
     def stop_playback(self):
         """Stop current playback"""
-        try:
-            self.media_player.stop()
-            log_message("Playback stopped")
-        except Exception as e:
-            log_message(f"Error stopping playback: {str(e)}")
+        with self._lock:
+            try:
+                self.media_player.stop()
+                log_message("Playback stopped")
+            except Exception as e:
+                log_message(f"Error stopping playback: {str(e)}")
     
     def next_track(self):
         """Skip to next track"""
-        if not self.current_album_tracks:
-            log_message("No tracks to skip")
-            return
-        
-        next_index = self.current_track_index + 1
-        
-        if next_index >= len(self.current_album_tracks):
-            if self.repeat_mode:
-                next_index = 0  # Loop back to first track
-            else:
-                log_message("End of album reached")
+        with self._lock:
+            if not self.current_album_tracks:
+                log_message("No tracks to skip")
                 return
-        
-        log_message(f"Skipping to track {next_index + 1}")
-        self._play_track_at_index(next_index)
+            
+            next_index = self.current_track_index + 1
+            
+            if next_index >= len(self.current_album_tracks):
+                if self.repeat_mode:
+                    next_index = 0  # Loop back to first track
+                else:
+                    log_message("End of album reached")
+                    return
+            
+            log_message(f"Skipping to track {next_index + 1}")
+            self._play_track_at_index(next_index)
     
     def previous_track(self):
         """Skip to previous track"""
-        if not self.current_album_tracks:
-            log_message("No tracks to skip")
-            return
-        
-        prev_index = self.current_track_index - 1
-        
-        if prev_index < 0:
-            if self.repeat_mode:
-                prev_index = len(self.current_album_tracks) - 1  # Loop to last track
-            else:
-                log_message("At beginning of album")
+        with self._lock:
+            if not self.current_album_tracks:
+                log_message("No tracks to skip")
                 return
-        
-        log_message(f"Skipping to track {prev_index + 1}")
-        self._play_track_at_index(prev_index)
+            
+            prev_index = self.current_track_index - 1
+            
+            if prev_index < 0:
+                if self.repeat_mode:
+                    prev_index = len(self.current_album_tracks) - 1  # Loop to last track
+                else:
+                    log_message("At beginning of album")
+                    return
+            
+            log_message(f"Skipping to track {prev_index + 1}")
+            self._play_track_at_index(prev_index)
     
     def set_volume(self, volume):
-        """Set playback volume (0-100)"""
-        try:
-            volume = max(0, min(100, volume))  # Clamp to 0-100
-            self.media_player.audio_set_volume(volume)
-            self.volume = volume
-            log_message(f"Volume set to {volume}%")
-            return True
-        except Exception as e:
-            log_message(f"Error setting volume: {str(e)}")
-            return False
+        """Set playback volume (0-100) and return the clamped value accepted.
+        
+        The libvlc call happens shortly afterwards in _apply_volume.
+        """
+        with self._lock:
+            self.volume = max(0, min(100, volume))  # Clamp to 0-100
+            
+            # Apply only the last value of a burst (e.g. a dragged slider)
+            if self._volume_timer:
+                self._volume_timer.cancel()
+            self._volume_timer = threading.Timer(VOLUME_DEBOUNCE, self._apply_volume)
+            self._volume_timer.daemon = True
+            self._volume_timer.start()
+            return self.volume
+    
+    def _apply_volume(self):
+        """Push the pending volume to VLC"""
+        with self._lock:
+            try:
+                self.media_player.audio_set_volume(self.volume)
+                log_message(f"Volume set to {self.volume}%")
+            except Exception as e:
+                log_message(f"Error setting volume: {str(e)}")
     
     def get_volume(self):
         """Get current volume level"""
@@ -532,51 +732,79 @@ class MusicPlayer:
     
     def is_playing(self):
         """Check if currently playing"""
-        try:
-            state = self.media_player.get_state()
-            return state == vlc.State.Playing
-        except:
-            return False
+        with self._lock:
+            try:
+                state = self.media_player.get_state()
+                return state == vlc.State.Playing
+            except:
+                return False
     
     def get_current_media_title(self):
         """Get current track title"""
-        if self.current_track_path:
-            return os.path.basename(self.current_track_path)
-        return None
+        return self.current_track_title
     
     def get_playback_info(self):
         """Get current playback position and length"""
-        try:
-            position = self.media_player.get_time()  # milliseconds
-            length = self.media_player.get_length()  # milliseconds
+        # Serialize refreshes so concurrent web requests make one round of libvlc calls
+        with self._lock:
+            now = time.monotonic()
+            cached_at, info = self._playback_info_cache
+            if info is not None and now - cached_at < PLAYBACK_INFO_TTL:
+                return dict(info)
             
-            return {
-                'position': position if position >= 0 else 0,
-                'length': length if length > 0 else 0
-            }
-        except:
-            return {'position': 0, 'length': 0}
+            try:
+                position = self.media_player.get_time()  # milliseconds
+                # Length only changes with the track, so ask VLC until it knows it
+                if self._track_length <= 0:
+                    self._track_length = self.media_player.get_length()  # milliseconds
+                length = self._track_length
+                
+                info = {
+                    'position': position if position >= 0 else 0,
+                    'length': length if length > 0 else 0
+                }
+            except:
+                info = {'position': 0, 'length': 0}
+            
+            self._playback_info_cache = (now, info)
+            return dict(info)
     
     def update_repeat_mode(self, repeat_enabled):
         """Update repeat mode"""
         self.repeat_mode = repeat_enabled
         log_message(f"Repeat mode {'enabled' if repeat_enabled else 'disabled'}")
     
+    def snapshot(self):
+        """Read track, play state and position together for one web request"""
+        with self._lock:
+            playback_info = self.get_playback_info()
+            return PlayerSnapshot(
+                album_state=self.album_state,
+                track_path=self.current_track_path,
+                track_title=self.current_track_title,
+                is_playing=self.is_playing(),
+                volume=self.volume,
+                position=playback_info['position'],
+                length=playback_info['length']
+            )
+    
     def get_status(self):
         """Get comprehensive player status"""
-        playback_info = self.get_playback_info()
+        with self._lock:
+            snap = self.snapshot()
+            track_index = self.current_track_index
         
         return {
-            'is_playing': self.is_playing(),
-            'current_album': self.current_album,
-            'current_track': self.get_current_media_title(),
-            'track_index': self.current_track_index,
-            'total_tracks': len(self.current_album_tracks),
-            'volume': self.volume,
+            'is_playing': snap.is_playing,
+            'current_album': snap.album_state.album,
+            'current_track': snap.track_title,
+            'track_index': track_index,
+            'total_tracks': len(snap.album_state.tracks),
+            'volume': snap.volume,
             'repeat_mode': self.repeat_mode,
             'single_track_mode': self.single_track_mode,
-            'position': playback_info['position'],
-            'length': playback_info['length'],
+            'position': snap.position,
+            'length': snap.length,
             'music_source': self.music_source,
             'control_source': self.control_source,
             'control_monitoring': self.control_monitor_running
@@ -584,6 +812,12 @@ class MusicPlayer:
     
     def _on_track_end(self, event):
         """Handle end of track event from VLC"""
+        # Callbacks run on libvlc's event thread, which must not call back into
+        # libvlc or wait on self._lock, so advance from a separate thread
+        threading.Thread(target=self._advance_after_track_end, daemon=True).start()
+    
+    def _advance_after_track_end(self):
+        """Start the next (or repeated) track after the current one ended"""
         try:
             if self.single_track_mode:
                 # In single track mode, repeat the same track
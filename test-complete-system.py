@@ -7,23 +7,14 @@ Tests all components in integration to ensure they work together properly.
 """
 
 import sys
-import time
 import threading
 import tempfile
 import os
 import json
 from pathlib import Path
 
-# Import our components
-try:
-    from usb_monitor import USBMonitor
-    from music_player import MusicPlayer
-    from web_interface import create_app
-    import requests
-except ImportError as e:
-    print(f"❌ Import error: {e}")
-    print("💡 Make sure all dependencies are installed: pip3 install -r requirements.txt")
-    sys.exit(1)
+# Components are imported inside each test so that phases which don't need
+# them (e.g. system requirements) don't pay for loading libvlc or Flask
 
 class SystemTester:
     def __init__(self):
@@ -64,6 +55,7 @@ class SystemTester:
     def test_usb_monitor(self):
         """Test USB monitoring functionality"""
         try:
+            from usb_monitor import USBMonitor
             monitor = USBMonitor()
             
             # Test initialization
@@ -88,9 +80,41 @@ class SystemTester:
         except Exception as e:
             self.log_result("USB Monitor test", False, f"Error: {e}")
             
+    def test_delayed_mount(self):
+        """Test that a drive mounted after the retry deadline is still picked up"""
+        try:
+            import time
+            import usb_monitor
+            
+            monitor = usb_monitor.USBMonitor()
+            monitor.monitoring = True
+            scans = threading.Semaphore(0)
+            monitor._check_usb_changes = scans.release
+            
+            # The simulated drive mounts well after MOUNT_WAIT_DELAYS run out
+            mount_at = time.monotonic() + sum(usb_monitor.MOUNT_WAIT_DELAYS) + 1.0
+            real_get_mounted_devices = usb_monitor.get_mounted_devices
+            usb_monitor.get_mounted_devices = lambda: {'sdz1'} if time.monotonic() >= mount_at else set()
+            try:
+                monitor._schedule_check('/dev/sdz1')
+                first = scans.acquire(timeout=5)
+                second = scans.acquire(timeout=5)
+            finally:
+                usb_monitor.get_mounted_devices = real_get_mounted_devices
+                monitor.monitoring = False
+                
+            if first and second:
+                self.log_result("Delayed mount", True, "Rescanned again once the late mount appeared")
+            else:
+                self.log_result("Delayed mount", False, "Late mount was not rescanned")
+                
+        except Exception as e:
+            self.log_result("Delayed mount", False, f"Error: {e}")
+            
     def test_music_player(self):
         """Test music player functionality"""
         try:
+            from music_player import MusicPlayer
             player = MusicPlayer()
             
             # Test initialization
@@ -109,9 +133,44 @@ class SystemTester:
         except Exception as e:
             self.log_result("Music Player test", False, f"Error: {e}")
             
+    def test_volume_debounce(self):
+        """Test that a burst of volume changes reaches VLC as one call"""
+        try:
+            import time
+            from music_player import MusicPlayer, VOLUME_DEBOUNCE
+            
+            applied = []
+            first_call = threading.Event()
+            
+            class FakeMediaPlayer:
+                def audio_set_volume(self, volume):
+                    applied.append(volume)
+                    first_call.set()
+                    
+            # Skip __init__ so no libvlc instance or audio device is needed
+            player = MusicPlayer.__new__(MusicPlayer)
+            player._lock = threading.RLock()
+            player._volume_timer = None
+            player.volume = 0
+            player.media_player = FakeMediaPlayer()
+            
+            accepted = [player.set_volume(v) for v in (10, 40, 70, 120)]
+            first_call.wait(timeout=2.0)
+            # Give any stray timer from the burst time to fire as well
+            time.sleep(VOLUME_DEBOUNCE * 4)
+            
+            if applied == [100] and accepted[-1] == 100:
+                self.log_result("Volume debounce", True, "4 quick changes → 1 audio_set_volume(100)")
+            else:
+                self.log_result("Volume debounce", False, f"audio_set_volume calls: {applied}")
+                
+        except Exception as e:
+            self.log_result("Volume debounce", False, f"Error: {e}")
+            
     def test_web_interface(self):
         """Test web interface"""
         try:
+            from web_interface import create_app
             app = create_app()
             self.log_result("Web app creation", True, "Flask app created successfully")
             
@@ -153,23 +212,23 @@ class SystemTester:
                 class TestHandler(FileSystemEventHandler):
                     def __init__(self):
                         self.events = []
+                        self.ready = threading.Event()
                         
                     def on_modified(self, event):
                         if not event.is_directory:
                             self.events.append(event)
+                            self.ready.set()
                 
                 handler = TestHandler()
                 observer.schedule(handler, temp_dir, recursive=False)
+                # The watch is registered before start() returns
                 observer.start()
                 
-                # Wait a moment for observer to start
-                time.sleep(0.1)
-                
                 # Modify the file
                 test_file.write_text("modified")
                 
                 # Wait for event
-                time.sleep(0.2)
+                handler.ready.wait(timeout=2.0)
                 
                 observer.stop()
                 observer.join()
@@ -185,6 +244,9 @@ class SystemTester:
     def test_integration(self):
         """Test integration between components"""
         try:
+            from usb_monitor import USBMonitor
+            from music_player import MusicPlayer
+            
             # Create components
             monitor = USBMonitor()
             player = MusicPlayer()
@@ -269,10 +331,12 @@ class SystemTester:
         
         print("🔌 Testing USB monitor...")
         self.test_usb_monitor()
+        self.test_delayed_mount()
         print("")
         
         print("🎵 Testing music player...")
         self.test_music_player()
+        self.test_volume_debounce()
         print("")
         
         print("🌐 Testing web interface...")
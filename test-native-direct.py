@@ -6,37 +6,70 @@ This verifies that we can access USB drives directly and use event-driven detect
 
 import os
 import sys
-import time
+import atexit
 import threading
-from utils import find_music_usb, find_control_usb, log_message
+from itertools import islice
+from utils import find_music_usb, find_control_usb, log_message, count_entries
 from usb_monitor import USBMonitor
+from config import CONTROL_FILE_NAME
+
+MUSIC_EXTENSIONS = frozenset({'.mp3', '.wav', '.flac', '.m4a'})
+
+def iter_music_files(root, exts=MUSIC_EXTENSIONS):
+    """Yield DirEntry objects for music files under root using an os.scandir walk"""
+    splitext = os.path.splitext  # local lookup inside the per-file loop
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue  # Unreadable folders are skipped, as os.walk does
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif splitext(entry.name)[1].lower() in exts:
+                    yield entry
+
+# Shared USBMonitor, started once and stopped when the script exits
+_monitor = None
+
+def get_monitor(on_music_change, on_control_change):
+    """Return the shared USBMonitor, routing its events to the given callbacks"""
+    global _monitor
+    if _monitor is None:
+        _monitor = USBMonitor()
+        atexit.register(_monitor.stop_monitoring)
+    _monitor.on_music_usb_change = on_music_change
+    _monitor.on_control_usb_change = on_control_change
+    return _monitor
 
 def test_event_driven_monitoring():
     """Test the new event-driven USB monitoring"""
     print("\n5. Testing Event-Driven USB Monitoring:")
     
     events_received = []
+    event_arrived = threading.Event()
     
     def on_music_change(new_path, old_path):
         events_received.append(f"Music USB: {old_path} → {new_path}")
         print(f"   🎵 Music USB event: {old_path} → {new_path}")
+        event_arrived.set()
         
     def on_control_change(new_path, old_path):
         events_received.append(f"Control USB: {old_path} → {new_path}")
         print(f"   🎛️ Control USB event: {old_path} → {new_path}")
+        event_arrived.set()
     
-    # Create USB monitor
-    monitor = USBMonitor(
-        on_music_usb_change=on_music_change,
-        on_control_usb_change=on_control_change
-    )
+    # Reuse the shared USB monitor; callbacks are per test
+    monitor = get_monitor(on_music_change, on_control_change)
     
     try:
-        print("   Starting event-driven monitoring for 5 seconds...")
+        print("   Starting event-driven monitoring for up to 5 seconds...")
         monitor.start_monitoring()
         
-        # Let it run for a few seconds
-        time.sleep(5)
+        # Finish as soon as an event arrives, or after 5 seconds without one
+        event_arrived.wait(timeout=5)
         
         # Check status
         status = monitor.get_current_usb_status()
@@ -53,8 +86,6 @@ def test_event_driven_monitoring():
         
     except Exception as e:
         print(f"   ❌ Error in event-driven monitoring: {e}")
-    finally:
-        monitor.stop_monitoring()
 
 def test_native_usb_access():
     """Test direct USB access for native deployment"""
@@ -67,24 +98,15 @@ def test_native_usb_access():
     if music_usb:
         print(f"✅ Music USB found at: {music_usb}")
         try:
-            files = os.listdir(music_usb)
-            print(f"✅ Can list contents: {len(files)} items")
+            print(f"✅ Can list contents: {count_entries(music_usb)} items")
             
-            # Try to find some music files
-            music_files = []
-            for root, dirs, files in os.walk(music_usb):
-                for file in files:
-                    if file.lower().endswith(('.mp3', '.wav', '.flac', '.m4a')):
-                        music_files.append(os.path.join(root, file))
-                        if len(music_files) >= 3:  # Just get a few examples
-                            break
-                if len(music_files) >= 3:
-                    break
+            # Try to find some music files, stopping after a few examples
+            music_files = list(islice(iter_music_files(music_usb), 3))
             
             if music_files:
                 print(f"✅ Found {len(music_files)} music files (showing first 3):")
-                for i, file in enumerate(music_files[:3]):
-                    print(f"   {i+1}. {os.path.basename(file)}")
+                for i, entry in enumerate(music_files):
+                    print(f"   {i+1}. {entry.name}")
             else:
                 print("⚠️  No music files found")
                 
@@ -103,23 +125,20 @@ def test_native_usb_access():
     if control_usb:
         print(f"✅ Control USB found at: {control_usb}")
         try:
-            files = os.listdir(control_usb)
-            print(f"✅ Can list contents: {len(files)} items")
+            print(f"✅ Can list contents: {count_entries(control_usb)} items")
             
             # Look for control file
-            from config import CONTROL_FILE_NAME
             control_file = os.path.join(control_usb, CONTROL_FILE_NAME)
-            if os.path.isfile(control_file):
-                print(f"✅ Control file found: {CONTROL_FILE_NAME}")
-                try:
-                    with open(control_file, 'r') as f:
-                        content = f.read().strip()
-                    print(f"✅ Control file content: '{content}'")
-                except Exception as e:
-                    print(f"⚠️  Could not read control file: {e}")
-            else:
+            try:
+                with open(control_file, 'r') as f:
+                    print(f"✅ Control file found: {CONTROL_FILE_NAME}")
+                    content = f.read().strip()
+                print(f"✅ Control file content: '{content}'")
+            except FileNotFoundError:
                 print(f"⚠️  Control file '{CONTROL_FILE_NAME}' not found")
                 print("💡 Create this file on your PLAY_CARD USB drive")
+            except Exception as e:
+                print(f"⚠️  Could not read control file: {e}")
                 
         except PermissionError as e:
             print(f"❌ Permission denied: {e}")
@@ -133,13 +152,17 @@ def test_native_usb_access():
     # Test user permissions
     print("\n3. Testing User Permissions:")
     try:
-        # Check if user is in plugdev group
-        import subprocess
-        result = subprocess.run(['groups'], capture_output=True, text=True)
-        groups = result.stdout.strip()
-        print(f"✅ User groups: {groups}")
+        # Check if user is in plugdev group (in-process, no `groups` subprocess)
+        import grp
+        group_names = set()
+        for gid in set(os.getgroups()) | {os.getgid()}:
+            try:
+                group_names.add(grp.getgrgid(gid).gr_name)
+            except KeyError:
+                group_names.add(str(gid))
+        print(f"✅ User groups: {' '.join(sorted(group_names))}")
         
-        if 'plugdev' in groups:
+        if 'plugdev' in group_names:
             print("✅ User is in 'plugdev' group (good for USB access)")
         else:
             print("⚠️  User is NOT in 'plugdev' group")
@@ -151,27 +174,33 @@ def test_native_usb_access():
     
     # Test /media/pi directory
     print("\n4. Testing /media/pi Directory:")
-    if os.path.exists("/media/pi"):
-        try:
-            items = os.listdir("/media/pi")
-            print(f"✅ /media/pi exists with {len(items)} items:")
-            for item in items:
-                item_path = f"/media/pi/{item}"
-                if os.path.isdir(item_path):
-                    try:
-                        sub_items = os.listdir(item_path)
-                        print(f"   📁 {item}/ ({len(sub_items)} items)")
-                    except PermissionError:
-                        print(f"   📁 {item}/ (permission denied)")
-                    except Exception as e:
-                        print(f"   📁 {item}/ (error: {e})")
-                else:
-                    print(f"   📄 {item}")
-        except Exception as e:
-            print(f"❌ Error listing /media/pi: {e}")
-    else:
+    # Listing directly also tells us whether /media/pi exists
+    try:
+        # DirEntry carries the file type from readdir, so no stat per item
+        with os.scandir("/media/pi") as it:
+            entries = list(it)
+    except FileNotFoundError:
+        entries = None
         print("❌ /media/pi directory does not exist")
         print("💡 This is unusual - are you on Raspberry Pi OS with desktop?")
+    except Exception as e:
+        entries = None
+        print(f"❌ Error listing /media/pi: {e}")
+    
+    if entries is not None:
+        # Collect the listing and write it in one go
+        lines = [f"✅ /media/pi exists with {len(entries)} items:"]
+        for entry in entries:
+            if entry.is_dir():
+                try:
+                    lines.append(f"   📁 {entry.name}/ ({count_entries(entry.path)} items)")
+                except PermissionError:
+                    lines.append(f"   📁 {entry.name}/ (permission denied)")
+                except Exception as e:
+                    lines.append(f"   📁 {entry.name}/ (error: {e})")
+            else:
+                lines.append(f"   📄 {entry.name}")
+        print("\n".join(lines))
     
     # Test event-driven monitoring
     test_event_driven_monitoring()
@@ -6,7 +6,7 @@ import os
 # Add current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from utils import find_music_usb, find_control_usb, log_message
+from utils import find_music_usb, find_control_usb, log_message, get_mount_points, count_entries
 
 def test_native_usb_detection():
     """Test the native USB detection functions."""
@@ -19,10 +19,10 @@ def test_native_usb_detection():
     if music_usb:
         print(f"   ✅ Music USB found: {music_usb}")
         try:
-            contents = os.listdir(music_usb)
-            print(f"   📂 Contents: {len(contents)} items")
-            if len(contents) <= 5:
-                print(f"   📄 Items: {contents}")
+            count = count_entries(music_usb)
+            print(f"   📂 Contents: {count} items")
+            if isinstance(count, int) and count <= 5:
+                print(f"   📄 Items: {os.listdir(music_usb)}")
         except Exception as e:
             print(f"   ❌ Error reading contents: {e}")
     else:
@@ -36,16 +36,15 @@ def test_native_usb_detection():
     if control_usb:
         print(f"   ✅ Control USB found: {control_usb}")
         control_file = os.path.join(control_usb, "playMusic.txt")
-        if os.path.isfile(control_file):
-            print(f"   ✅ playMusic.txt found: {control_file}")
-            try:
-                with open(control_file, 'r') as f:
-                    content = f.read().strip()
-                print(f"   📄 Content: '{content}'")
-            except Exception as e:
-                print(f"   ❌ Error reading control file: {e}")
-        else:
+        try:
+            with open(control_file, 'r') as f:
+                print(f"   ✅ playMusic.txt found: {control_file}")
+                content = f.read().strip()
+            print(f"   📄 Content: '{content}'")
+        except FileNotFoundError:
             print(f"   ❌ playMusic.txt not found in {control_usb}")
+        except Exception as e:
+            print(f"   ❌ Error reading control file: {e}")
     else:
         print("   ❌ No control USB found")
     
@@ -54,22 +53,40 @@ def test_native_usb_detection():
     # Show all mounted USB drives for reference
     print("3. All mounted USB drives in /media/pi/:")
     try:
-        if os.path.exists("/media/pi"):
-            items = os.listdir("/media/pi")
-            if items:
-                for item in items:
-                    mount_path = f"/media/pi/{item}"
-                    if os.path.isdir(mount_path) and os.path.ismount(mount_path):
-                        print(f"   📍 {mount_path}")
-                        try:
-                            contents = os.listdir(mount_path)
-                            print(f"      ({len(contents)} items)")
-                        except:
-                            print("      (inaccessible)")
-            else:
-                print("   (No items in /media/pi/)")
-        else:
+        # Listing directly also tells us whether /media/pi exists
+        try:
+            # DirEntry carries the file type from readdir, so no stat per item
+            with os.scandir("/media/pi") as it:
+                entries = list(it)
+        except FileNotFoundError:
+            entries = None
             print("   ❌ /media/pi/ directory not found")
+        
+        if entries:
+            # One parse of the kernel mount table answers every entry; without
+            # /proc, a mounted drive sits on a different device than /media/pi
+            mounts = get_mount_points()
+            if mounts is None:
+                parent_dev = os.lstat("/media/pi").st_dev
+            # Collect the listing and write it in one go
+            lines = []
+            for entry in entries:
+                mount_path = entry.path
+                if mounts is not None:
+                    is_mount = mount_path in mounts
+                else:
+                    is_mount = (entry.is_dir(follow_symlinks=False)
+                                and entry.stat(follow_symlinks=False).st_dev != parent_dev)
+                if is_mount:
+                    lines.append(f"   📍 {mount_path}")
+                    try:
+                        lines.append(f"      ({count_entries(mount_path)} items)")
+                    except:
+                        lines.append("      (inaccessible)")
+            if lines:
+                print("\n".join(lines))
+        elif entries is not None:
+            print("   (No items in /media/pi/)")
     except Exception as e:
         print(f"   ❌ Error scanning /media/pi/: {e}")
     
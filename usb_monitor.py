@@ -6,12 +6,53 @@ Uses udev events instead of continuous polling for better performance
 
 import os
 import time
+import select
+import socket
 import threading
 import subprocess
-from pathlib import Path
-from utils import log_message, is_usb_accessible
+from utils import log_message, is_usb_accessible, get_labelled_mounts, get_mounted_devices, set_usb_state, clear_usb_state
 from config import CONTROL_FILE_NAME
 
+try:
+    import grp
+except ImportError:  # Not available on Windows
+    grp = None
+
+# A drive must be missing from this many consecutive checks before it is
+# treated as removed; cheap flash drives can fail a single probe transiently
+UNMOUNT_CONFIRM_CHECKS = 2
+UNMOUNT_CONFIRM_DELAY = 0.5  # seconds between confirmation checks
+
+# Upper bound on a mountinfo wait so stop_monitoring() is noticed promptly
+MOUNTINFO_WAIT_MS = 1000
+
+# Kernel uevents arrive on this netlink protocol/multicast group as
+# NUL-separated KEY=VALUE fields (udevd's group 2 uses a binary header)
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+UEVENT_BUFFER_SIZE = 64 * 1024
+UEVENT_RCVBUF = 1 << 20
+UEVENT_WAIT_MS = 1000
+UEVENT_ACTIONS = frozenset({'add', 'remove', 'change'})
+
+# udevadm monitor --property prints one KEY=VALUE per line and ends each
+# event with a blank line; only these properties are kept
+UDEV_PROPERTY_PREFIXES = (b'ACTION=', b'SUBSYSTEM=', b'DEVNAME=')
+UDEV_ACTIONS = frozenset({b'add', b'remove'})
+
+# One drive insertion emits a burst of uevents (disk, partitions, ...): rescan
+# once the burst has been quiet this long, but never later than the max delay
+UEVENT_DEBOUNCE = 0.3
+UEVENT_MAX_DELAY = 1.0
+
+# After a drive is added, the auto-mounter mounts it a little later: recheck
+# mountinfo at these growing intervals (seconds) until the device is mounted,
+# then rescan anyway once they run out
+MOUNT_WAIT_DELAYS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 0.5, 0.5)
+# Slow drives (spin-up, large FAT volumes) can take longer; mounting emits no
+# further uevent, so keep watching the mount table this long after a rescan
+MOUNT_WATCH_TIMEOUT = 30.0
+
 class USBMonitor:
     def __init__(self, on_music_usb_change=None, on_control_usb_change=None):
         self.on_music_usb_change = on_music_usb_change
@@ -20,6 +61,19 @@ class USBMonitor:
         self.current_control_usb = None
         self.monitoring = False
         self.monitor_thread = None
+        # Set by stop_monitoring() to wake the monitor thread from its waits
+        self._stop_event = threading.Event()
+        self._udev_process = None
+        # Serializes rescans so overlapping events can't dispatch the same change twice
+        self._check_lock = threading.Lock()
+        # Pending debounced rescan and when its burst of events started
+        self._debounce_lock = threading.Lock()
+        self._debounce_timer = None
+        self._first_event_at = 0.0
+        # Devices added since the last rescan that may not be mounted yet
+        self._pending_mounts = set()
+        # Names of this process's groups, looked up once
+        self._group_names = None
         
     def start_monitoring(self):
         """Start event-driven USB monitoring"""
@@ -27,67 +81,137 @@ class USBMonitor:
             return
             
         self.monitoring = True
+        self._stop_event.clear()
         log_message("Starting event-driven USB monitoring...")
         
         # Initial scan for already mounted drives
         self._initial_scan()
         
-        # Start udev monitoring in separate thread
-        self.monitor_thread = threading.Thread(target=self._monitor_udev_events, daemon=True)
+        # Start uevent monitoring in separate thread
+        self.monitor_thread = threading.Thread(target=self._monitor_uevents, daemon=True)
         self.monitor_thread.start()
         
     def stop_monitoring(self):
         """Stop USB monitoring"""
         self.monitoring = False
+        self._stop_event.set()
+        # Unblock a udevadm readline so the thread can exit
+        process = self._udev_process
+        if process:
+            process.terminate()
         if self.monitor_thread:
             self.monitor_thread.join(timeout=2)
+        clear_usb_state()
         log_message("USB monitoring stopped")
         
     def _initial_scan(self):
         """Scan for already mounted USB drives"""
         log_message("Performing initial USB scan...")
         
-        music_usb = self._find_music_usb()
-        control_usb = self._find_control_usb()
+        with self._check_lock:
+            music_usb, control_usb = self._scan_usb_drives()
+            
+            if music_usb != self.current_music_usb:
+                self._handle_music_usb_change(music_usb)
+                
+            if control_usb != self.current_control_usb:
+                self._handle_control_usb_change(control_usb)
+                
+            set_usb_state(self.current_music_usb, self.current_control_usb)
+            
+    def _open_uevent_socket(self):
+        """Open a netlink socket subscribed to kernel uevents"""
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_KOBJECT_UEVENT)
+        try:
+            # A larger buffer keeps event bursts from overflowing the socket;
+            # RCVBUFFORCE needs CAP_NET_ADMIN, so fall back to the capped option
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_RCVBUFFORCE', 33), UEVENT_RCVBUF)
+            except OSError:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UEVENT_RCVBUF)
+            sock.bind((0, UEVENT_KERNEL_GROUP))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+        
+    @staticmethod
+    def _parse_uevent(data):
+        """Parse a kernel uevent payload into a dict of its KEY=VALUE fields"""
+        fields = {}
+        for item in data.split(b'\0'):
+            key, sep, value = item.partition(b'=')
+            if sep:
+                fields[key.decode('ascii', 'replace')] = value.decode('utf-8', 'replace')
+        return fields
         
-        if music_usb != self.current_music_usb:
-            self._handle_music_usb_change(music_usb)
+    def _monitor_uevents(self):
+        """Monitor kernel uevents directly, falling back to udevadm"""
+        try:
+            sock = self._open_uevent_socket()
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+        except (OSError, AttributeError) as e:
+            log_message(f"Netlink uevents unavailable ({e}), using udevadm...")
+            self._monitor_udev_events()
+            return
             
-        if control_usb != self.current_control_usb:
-            self._handle_control_usb_change(control_usb)
+        log_message("Started netlink uevent monitoring")
+        with sock:
+            while self.monitoring:
+                try:
+                    # Bounded wait so stop_monitoring() is noticed promptly
+                    if not poller.poll(UEVENT_WAIT_MS):
+                        continue
+                    event = self._parse_uevent(sock.recv(UEVENT_BUFFER_SIZE))
+                    if event.get('SUBSYSTEM') == 'block' and event.get('ACTION') in UEVENT_ACTIONS:
+                        added = event.get('DEVNAME') if event.get('ACTION') == 'add' else None
+                        self._schedule_check(added)
+                except Exception as e:
+                    if self.monitoring:
+                        log_message(f"Error reading uevents: {e}")
+                    self._stop_event.wait(1)
             
     def _monitor_udev_events(self):
         """Monitor udev events for USB changes"""
         try:
             # Use udevadm to monitor block device events
             cmd = ['udevadm', 'monitor', '--property', '--subsystem-match=block']
+            # Fully buffered: iterating the pipe yields lines without a read per line.
+            # Nothing reads stderr, so don't let it fill a pipe
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                bufsize=1
+                stderr=subprocess.DEVNULL
             )
+            self._udev_process = process
             
             log_message("Started udev event monitoring")
             
-            while self.monitoring:
-                try:
-                    line = process.stdout.readline()
-                    if not line:
+            event = {}
+            try:
+                for line in process.stdout:
+                    if not self.monitoring:
                         break
                         
-                    # Look for add/remove events
-                    if 'ACTION=add' in line or 'ACTION=remove' in line:
-                        # Give the system a moment to mount/unmount
-                        time.sleep(1)
-                        self._check_usb_changes()
+                    line = line.rstrip(b'\n')
+                    if not line:
+                        # End of an event: look for block add/remove events
+                        if event.get(b'SUBSYSTEM') == b'block' and event.get(b'ACTION') in UDEV_ACTIONS:
+                            added = event.get(b'DEVNAME') if event.get(b'ACTION') == b'add' else None
+                            self._schedule_check(added and os.fsdecode(added))
+                        event = {}
+                    elif line.startswith(UDEV_PROPERTY_PREFIXES):
+                        key, _, value = line.partition(b'=')
+                        event[key] = value
                         
-                except Exception as e:
-                    if self.monitoring:  # Only log if we're still supposed to be monitoring
-                        log_message(f"Error reading udev events: {e}")
-                    break
+            except Exception as e:
+                if self.monitoring:  # Only log if we're still supposed to be monitoring
+                    log_message(f"Error reading udev events: {e}")
                     
+            self._udev_process = None
+            process.terminate()
+            
         except FileNotFoundError:
             log_message("udevadm not found, falling back to polling...")
             self._fallback_polling()
@@ -96,33 +220,164 @@ class USBMonitor:
             self._fallback_polling()
             
     def _fallback_polling(self):
-        """Fallback to polling if udev monitoring fails"""
+        """Fallback if udev monitoring fails: mount table notifications, else polling"""
+        if self._watch_mountinfo():
+            return
+            
         log_message("Using fallback polling method (checking every 3 seconds)")
         
         while self.monitoring:
             try:
                 self._check_usb_changes()
-                time.sleep(3)  # Much less frequent than before
+                self._stop_event.wait(3)  # Much less frequent than before
             except Exception as e:
                 if self.monitoring:
                     log_message(f"Error in USB polling: {e}")
-                time.sleep(5)
+                self._stop_event.wait(5)
+                
+    def _watch_mountinfo(self):
+        """Rescan whenever the kernel mount table changes.
+
+        /proc/self/mountinfo reports POLLPRI|POLLERR on every mount or unmount,
+        so the thread sleeps until an auto-mounter actually mounts a drive.
+        Returns False if notifications are unavailable on this system.
+        """
+        try:
+            mountinfo = open('/proc/self/mountinfo')
+            poller = select.poll()
+            poller.register(mountinfo, select.POLLPRI | select.POLLERR)
+        except (OSError, AttributeError) as e:
+            log_message(f"Mount table notifications unavailable: {e}")
+            return False
+            
+        log_message("Using /proc/self/mountinfo notifications for USB detection")
+        with mountinfo:
+            while self.monitoring:
+                try:
+                    if not poller.poll(MOUNTINFO_WAIT_MS):
+                        continue
+                    # Re-read so the next change is reported again
+                    mountinfo.seek(0)
+                    mountinfo.read()
+                    self._check_usb_changes()
+                except Exception as e:
+                    if self.monitoring:
+                        log_message(f"Error watching mount table: {e}")
+                    self._stop_event.wait(5)
+        return True
+        
+    def _schedule_check(self, added_device=None):
+        """Coalesce a burst of uevents into a single rescan"""
+        with self._debounce_lock:
+            if added_device:
+                self._pending_mounts.add(os.path.basename(added_device))
+            now = time.monotonic()
+            if self._debounce_timer:
+                self._debounce_timer.cancel()
+            else:
+                self._first_event_at = now
+            delay = min(UEVENT_DEBOUNCE, max(0.0, self._first_event_at + UEVENT_MAX_DELAY - now))
+            self._debounce_timer = threading.Timer(delay, self._run_scheduled_check)
+            self._debounce_timer.daemon = True
+            self._debounce_timer.start()
+            
+    def _run_scheduled_check(self):
+        """Timer callback for _schedule_check"""
+        with self._debounce_lock:
+            self._debounce_timer = None
+            pending, self._pending_mounts = self._pending_mounts, set()
+        mounted = self._wait_for_mount(pending) if pending else True
+        if self.monitoring:
+            self._check_usb_changes()
+        if not mounted and self.monitoring and self._watch_for_mount(pending, MOUNT_WATCH_TIMEOUT):
+            self._check_usb_changes()
+            
+    def _wait_for_mount(self, devices):
+        """Wait briefly until one of the added devices is mounted.
+        
+        Returns False if none was mounted by the last retry.
+        """
+        for delay in MOUNT_WAIT_DELAYS:
+            mounted = get_mounted_devices()
+            if mounted is None or not mounted.isdisjoint(devices):
+                return True
+            if self._stop_event.wait(delay):
+                return True
+        log_message(f"No mount appeared yet for {', '.join(sorted(devices))}, rescanning anyway")
+        return False
+        
+    def _watch_for_mount(self, devices, timeout):
+        """Block on mount table changes until one of devices is mounted.
+        
+        Returns True once it is, False on timeout or stop.
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            mountinfo = open('/proc/self/mountinfo')
+            poller = select.poll()
+            poller.register(mountinfo, select.POLLPRI | select.POLLERR)
+        except (OSError, AttributeError):
+            mountinfo = poller = None
+            
+        try:
+            while self.monitoring:
+                mounted = get_mounted_devices()
+                if mounted is not None and not mounted.isdisjoint(devices):
+                    log_message(f"Delayed mount detected for {', '.join(sorted(devices))}")
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if poller:
+                    # Bounded wait so stop_monitoring() is noticed promptly
+                    if poller.poll(min(remaining * 1000, MOUNTINFO_WAIT_MS)):
+                        mountinfo.seek(0)
+                        mountinfo.read()
+                elif self._stop_event.wait(min(remaining, 0.5)):
+                    break
+        finally:
+            if mountinfo:
+                mountinfo.close()
                 
+        log_message(f"No mount appeared for {', '.join(sorted(devices))}")
+        return False
+        
     def _check_usb_changes(self):
         """Check for USB drive changes"""
-        music_usb = self._find_music_usb()
-        control_usb = self._find_control_usb()
-        
-        if music_usb != self.current_music_usb:
-            self._handle_music_usb_change(music_usb)
+        with self._check_lock:
+            music_usb, control_usb = self._scan_usb_drives()
             
-        if control_usb != self.current_control_usb:
-            self._handle_control_usb_change(control_usb)
+            # Re-probe drives that just disappeared before reporting an unmount
+            if self.current_music_usb and not music_usb:
+                music_usb = self._confirm_missing(lambda: self._scan_usb_drives()[0])
+            if self.current_control_usb and not control_usb:
+                control_usb = self._confirm_missing(lambda: self._scan_usb_drives()[1])
+            
+            if music_usb != self.current_music_usb:
+                self._handle_music_usb_change(music_usb)
+                
+            if control_usb != self.current_control_usb:
+                self._handle_control_usb_change(control_usb)
+                
+            set_usb_state(self.current_music_usb, self.current_control_usb)
             
+    def _confirm_missing(self, find_usb):
+        """Repeat a failed lookup so a single transient error isn't an unmount"""
+        for _ in range(UNMOUNT_CONFIRM_CHECKS - 1):
+            if self._stop_event.wait(UNMOUNT_CONFIRM_DELAY):
+                break
+            found = find_usb()
+            if found:
+                log_message(f"USB lookup recovered after transient failure: {found}")
+                return found
+        return None
+        
     def _handle_music_usb_change(self, new_music_usb):
         """Handle music USB mount/unmount"""
         old_music_usb = self.current_music_usb
         self.current_music_usb = new_music_usb
+        # Publish before the callback so anything it calls sees the new drive
+        set_usb_state(self.current_music_usb, self.current_control_usb)
         
         if old_music_usb and not new_music_usb:
             log_message(f"Music USB unmounted: {old_music_usb}")
@@ -138,6 +393,8 @@ class USBMonitor:
         """Handle control USB mount/unmount"""
         old_control_usb = self.current_control_usb
         self.current_control_usb = new_control_usb
+        # Publish before the callback so anything it calls sees the new drive
+        set_usb_state(self.current_music_usb, self.current_control_usb)
         
         if old_control_usb and not new_control_usb:
             log_message(f"Control USB unmounted: {old_control_usb}")
@@ -149,30 +406,61 @@ class USBMonitor:
         if self.on_control_usb_change:
             self.on_control_usb_change(new_control_usb, old_control_usb)
             
-    def _find_music_usb(self):
+    def _media_candidates(self):
+        """Return (name, path) for each mounted drive.
+        
+        Every directory under /media/pi is a candidate under the auto-mounter's
+        name for it. Filesystem labels from the udev database add drives that
+        are mounted elsewhere or under an unrelated directory name; a directory
+        like PLAY_CARD1 keeps its own name so numbered drives still sort.
+        """
+        try:
+            with os.scandir("/media/pi") as entries:
+                candidates = [(entry.name, entry.path) for entry in entries if entry.is_dir()]
+        except FileNotFoundError:
+            candidates = []
+            
+        names = {path: name for name, path in candidates}
+        for mount_point, label in sorted((get_labelled_mounts() or {}).items()):
+            name = names.get(mount_point)
+            if name is None or not name.startswith(label):
+                candidates.append((label, mount_point))
+        return candidates
+        
+    def _scan_usb_drives(self):
+        """Find the music and control USBs from one listing of mounted drives"""
+        try:
+            candidates = self._media_candidates()
+        except FileNotFoundError:
+            candidates = []
+        except PermissionError:
+            log_message("Permission denied accessing /media/pi - checking user groups")
+            self._check_user_permissions()
+            candidates = []
+        except Exception as e:
+            log_message(f"Error scanning /media/pi: {e}")
+            candidates = []
+            
+        music_usb = self._find_music_usb(candidates)
+        control_usb = self._find_control_usb(candidates, music_usb)
+        return music_usb, control_usb
+        
+    def _find_music_usb(self, candidates):
         """Find music USB with proper permission handling"""
         # Check environment override first
         env_path = os.environ.get('MUSIC_USB_MOUNT')
         if env_path and self._is_usb_accessible_with_permissions(env_path):
             return env_path
             
-        # Check /media/pi for MUSIC drives
-        media_pi = Path("/media/pi")
-        if media_pi.exists():
-            try:
-                for item in media_pi.iterdir():
-                    if item.name.startswith("MUSIC") and item.is_dir():
-                        if self._is_usb_accessible_with_permissions(str(item)):
-                            return str(item)
-            except PermissionError:
-                log_message("Permission denied accessing /media/pi - checking user groups")
-                self._check_user_permissions()
-            except Exception as e:
-                log_message(f"Error scanning /media/pi: {e}")
-                
+        # Check mounted drives for MUSIC labels
+        for name, path in candidates:
+            if name.startswith("MUSIC"):
+                if self._is_usb_accessible_with_permissions(path):
+                    return path
+                    
         return None
         
-    def _find_control_usb(self):
+    def _find_control_usb(self, candidates, music_usb):
         """Find control USB with proper permission handling"""
         # Check environment override first
         env_path = os.environ.get('CONTROL_USB_MOUNT')
@@ -181,44 +469,18 @@ class USBMonitor:
             if self._is_usb_accessible_with_permissions(env_path) and os.path.isfile(control_file):
                 return env_path
                 
-        # Check /media/pi for PLAY_CARD drives with priority order
-        media_pi = Path("/media/pi")
-        if media_pi.exists():
-            try:
-                # First, look for exact match "PLAY_CARD"
-                play_card_exact = media_pi / "PLAY_CARD"
-                if play_card_exact.exists() and play_card_exact.is_dir():
-                    if self._is_usb_accessible_with_permissions(str(play_card_exact)):
-                        control_file = play_card_exact / CONTROL_FILE_NAME
-                        if control_file.is_file():
-                            return str(play_card_exact)
-                
-                # Then look for numbered variants in order (PLAY_CARD1, PLAY_CARD2, etc.)
-                candidates = []
-                for item in media_pi.iterdir():
-                    if item.name.startswith("PLAY_CARD") and item.is_dir():
-                        if self._is_usb_accessible_with_permissions(str(item)):
-                            control_file = item / CONTROL_FILE_NAME
-                            if control_file.is_file():
-                                candidates.append(str(item))
-                
-                # Sort candidates to prefer lower numbers
-                candidates.sort(key=lambda x: (len(os.path.basename(x)), os.path.basename(x)))
-                
-                if candidates:
-                    selected = candidates[0]
-                    if len(candidates) > 1:
-                        log_message(f"Multiple PLAY_CARD drives found, using: {os.path.basename(selected)}")
-                    return selected
+        # Check mounted drives for PLAY_CARD labels with priority order: the
+        # exact match "PLAY_CARD" first, then numbered variants (PLAY_CARD1,
+        # PLAY_CARD2, etc.). Only probe drives until the best one passes.
+        media = sorted((len(name), name, path) for name, path in candidates if name.startswith("PLAY_CARD"))
+        for _, name, path in media:
+            if self._is_usb_accessible_with_permissions(path):
+                if os.path.isfile(os.path.join(path, CONTROL_FILE_NAME)):
+                    if len(media) > 1:
+                        log_message(f"Multiple PLAY_CARD drives found, using: {name}")
+                    return path
                     
-            except PermissionError:
-                log_message("Permission denied accessing /media/pi - checking user groups")
-                self._check_user_permissions()
-            except Exception as e:
-                log_message(f"Error scanning /media/pi: {e}")
-                
         # Fallback: check if control file is on music USB
-        music_usb = self._find_music_usb()
         if music_usb:
             control_file = os.path.join(music_usb, CONTROL_FILE_NAME)
             if os.path.isfile(control_file):
@@ -270,18 +532,30 @@ class USBMonitor:
         except Exception as e:
             log_message(f"Error attempting permission fix: {e}")
             
+    def _get_group_names(self):
+        """Return this process's group names; membership is fixed until relogin"""
+        if self._group_names is None:
+            if grp:
+                names = set()
+                for gid in set(os.getgroups()) | {os.getegid()}:
+                    try:
+                        names.add(grp.getgrgid(gid).gr_name)
+                    except KeyError:
+                        names.add(str(gid))
+            else:
+                result = subprocess.run(['groups'], capture_output=True, text=True)
+                names = set(result.stdout.split())
+            self._group_names = frozenset(names)
+        return self._group_names
+        
     def _check_user_permissions(self):
         """Check and report user group memberships"""
         try:
-            result = subprocess.run(['groups'], capture_output=True, text=True)
-            groups = result.stdout.strip()
+            group_names = self._get_group_names()
+            groups = ' '.join(sorted(group_names))
             
             required_groups = ['plugdev', 'audio']
-            missing_groups = []
-            
-            for group in required_groups:
-                if group not in groups:
-                    missing_groups.append(group)
+            missing_groups = [group for group in required_groups if group not in group_names]
                     
             if missing_groups:
                 log_message(f"User missing required groups: {missing_groups}")
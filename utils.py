@@ -2,61 +2,195 @@
 # utils.py - Unified USB detection for both native and Docker deployments
 
 import os
+import re
 import time
-import glob
+import queue
+import atexit
+import threading
 import subprocess
-from urllib.parse import unquote
+from bisect import bisect_left
+from collections import deque, OrderedDict
+from itertools import islice
 from config import CONTROL_FILE_NAME
-from datetime import datetime
 
-# Global log variable
-log_messages = []
+# Per-drive USB scan details are logged only when SLAB_DEBUG=1
+USB_SCAN_DEBUG = os.environ.get('SLAB_DEBUG') == '1'
+
+# Most recent log lines, shown in the web interface
+log_messages = deque(maxlen=500)
+# Appends are atomic, but iterating while another thread appends raises
+_log_lock = threading.Lock()
+
+# (second, formatted timestamp) of the most recent log line
+_timestamp_cache = (0, "")
+
+def _log_timestamp():
+    """Return the current timestamp, formatting it at most once per second."""
+    global _timestamp_cache
+    now = int(time.time())
+    cached_second, cached_text = _timestamp_cache
+    if now != cached_second:
+        cached_text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+        _timestamp_cache = (now, cached_text)
+    return cached_text
+
+# Lines waiting to be written to stdout by the log writer thread; bounded so
+# a stalled terminal can't grow memory without limit
+LOG_QUEUE_SIZE = 10000
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+
+# Seconds to wait at exit for pending log lines before giving up
+LOG_DRAIN_TIMEOUT = 2.0
+
+# Queued after the last line at exit to stop the writer thread
+_LOG_STOP = object()
+
+def _log_writer():
+    """Write queued log lines so callers never block on a slow terminal."""
+    while True:
+        line = _log_queue.get()
+        if line is _LOG_STOP:
+            break
+        try:
+            print(line)
+        except Exception:
+            pass
+        finally:
+            _log_queue.task_done()
+
+_log_writer_thread = threading.Thread(target=_log_writer, name="log-writer", daemon=True)
+_log_writer_thread.start()
+
+def _drain_log_queue():
+    """Flush pending lines on exit, but never hang on a stalled stdout."""
+    try:
+        _log_queue.put(_LOG_STOP, timeout=LOG_DRAIN_TIMEOUT)
+    except queue.Full:
+        return
+    _log_writer_thread.join(timeout=LOG_DRAIN_TIMEOUT)
+
+# Drain pending lines on exit so shutdown messages are not lost
+atexit.register(_drain_log_queue)
+
+def _enqueue_log_line(line):
+    """Queue a line for stdout, dropping the oldest pending line if full."""
+    try:
+        _log_queue.put_nowait(line)
+    except queue.Full:
+        try:
+            _log_queue.get_nowait()
+            _log_queue.task_done()
+        except queue.Empty:
+            pass
+        try:
+            _log_queue.put_nowait(line)
+        except queue.Full:
+            pass
 
 def log_message(message):
     """Log a message with timestamp."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] {message}")
+    line = f"[{_log_timestamp()}] {message}"
+    with _log_lock:
+        log_messages.append(line)
+    _enqueue_log_line(line)
+
+def recent_log_messages(count):
+    """Return the newest count log lines, oldest first."""
+    with _log_lock:
+        return list(islice(reversed(log_messages), count))[::-1]
+
+# Directory listings in diagnostics stop counting past this many entries
+LISTING_LIMIT = 1000
+
+def count_entries(path, limit=LISTING_LIMIT):
+    """Count entries in path, stopping early on very large directories."""
+    with os.scandir(path) as it:
+        count = sum(1 for _ in islice(it, limit + 1))
+    return count if count <= limit else f"{limit}+"
 
 def is_usb_accessible(mount_path):
     """Check if a USB path is actually accessible and has content."""
     try:
-        if not os.path.exists(mount_path):
+        # Only one entry is needed to know the drive isn't empty, and opening
+        # the directory already reports a missing path or a non-directory
+        try:
+            with os.scandir(mount_path) as entries:
+                has_content = next(entries, None) is not None
+        except FileNotFoundError:
             return False, "Path does not exist"
-        
-        if not os.path.isdir(mount_path):
+        except NotADirectoryError:
             return False, "Not a directory"
-        
-        # Try to list contents with timeout protection
-        try:
-            contents = os.listdir(mount_path)
         except (OSError, PermissionError) as e:
             return False, f"Cannot list directory: {str(e)}"
         
-        if not contents:
+        if not has_content:
             return False, "Directory is empty"
         
-        # Additional test: try to access a file to ensure it's really mounted
-        try:
-            for item in contents[:3]:  # Test first 3 items
-                item_path = os.path.join(mount_path, item)
-                if os.path.isfile(item_path):
-                    # Try to get file stats (this will fail if mount is stale)
-                    os.stat(item_path)
-                    break
-        except (OSError, PermissionError) as e:
-            return False, f"Mount appears stale: {str(e)}"
+        # statvfs queries the filesystem itself, so a stale mount fails here
+        # without stat'ing individual files
+        if hasattr(os, 'statvfs'):
+            try:
+                os.statvfs(mount_path)
+            except OSError as e:
+                return False, f"Mount appears stale: {str(e)}"
         
-        return True, f"Accessible with {len(contents)} items"
+        return True, "Accessible"
         
     except Exception as e:
         return False, f"Unexpected error: {str(e)}"
 
+# Drives last reported by a running USBMonitor, or None when no monitor is
+# running. The dict is replaced, never mutated, so readers need no lock.
+_usb_state = None
+
+def set_usb_state(music_usb, control_usb):
+    """Publish the monitor's current drives for find_music_usb/find_control_usb."""
+    global _usb_state
+    _usb_state = {'music_usb': music_usb, 'control_usb': control_usb}
+
+def clear_usb_state():
+    """Forget the monitor's drives so lookups scan /media/pi again."""
+    global _usb_state
+    _usb_state = None
+
+# Seconds a /media/pi lookup is reused while the directory is unchanged
+USB_LOOKUP_TTL = 2.0
+
+# lookup name -> (monotonic time, /media/pi mtime, found path)
+_usb_lookup_cache = {}
+
+def _cached_usb_lookup(name, scan):
+    """Return scan()'s recent result unless /media/pi or the found drive changed."""
+    try:
+        dir_mtime = os.stat("/media/pi").st_mtime_ns
+    except OSError:
+        dir_mtime = None
+    now = time.monotonic()
+    
+    cached = _usb_lookup_cache.get(name)
+    if cached and now - cached[0] < USB_LOOKUP_TTL and cached[1] == dir_mtime:
+        path = cached[2]
+        if path is None or os.path.isdir(path):
+            return path
+    
+    path = scan()
+    _usb_lookup_cache[name] = (now, dir_mtime, path)
+    return path
+
 def find_music_usb():
     """
     Find music USB drive - Native deployment (simplified)
     Looks directly at desktop auto-mount locations
     """
     
+    # The USB monitor already knows the answer while it is running
+    state = _usb_state
+    if state is not None:
+        return state['music_usb']
+    return _cached_usb_lookup('music', _scan_music_usb)
+
+def _scan_music_usb():
+    """Scan the environment override and /media/pi for the music USB."""
     # Priority 1: Environment variable override
     env_path = os.environ.get('MUSIC_USB_MOUNT')
     if env_path:
@@ -68,20 +202,20 @@ def find_music_usb():
             log_message(f"Environment music path not accessible: {env_path} - {reason}")
     
     # Priority 2: Direct desktop mounts (primary for native deployment)
-    if os.path.exists("/media/pi"):
-        try:
-            media_items = os.listdir("/media/pi")
-            for item in media_items:
-                if item.startswith("MUSIC"):
-                    mount_path = f"/media/pi/{item}"
-                    is_accessible, reason = is_usb_accessible(mount_path)
+    try:
+        with os.scandir("/media/pi") as entries:
+            for entry in entries:
+                if entry.name.startswith("MUSIC") and entry.is_dir():
+                    is_accessible, reason = is_usb_accessible(entry.path)
                     if is_accessible:
-                        log_message(f"Music USB found at: {mount_path}")
-                        return mount_path
-                    else:
-                        log_message(f"Music USB not accessible: {mount_path} - {reason}")
-        except Exception as e:
-            log_message(f"Error scanning /media/pi: {e}")
+                        log_message(f"Music USB found at: {entry.path}")
+                        return entry.path
+                    elif USB_SCAN_DEBUG:
+                        log_message(f"Music USB not accessible: {entry.path} - {reason}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log_message(f"Error scanning /media/pi: {e}")
     
     log_message("No accessible music USB drive found")
     return None
@@ -92,6 +226,14 @@ def find_control_usb():
     Looks directly at desktop auto-mount locations
     """
     
+    # The USB monitor already knows the answer while it is running
+    state = _usb_state
+    if state is not None:
+        return state['control_usb']
+    return _cached_usb_lookup('control', _scan_control_usb)
+
+def _scan_control_usb():
+    """Scan the environment override, /media/pi and the music USB for the control USB."""
     # Priority 1: Environment variable override
     env_path = os.environ.get('CONTROL_USB_MOUNT')
     if env_path:
@@ -104,21 +246,21 @@ def find_control_usb():
             log_message(f"Environment control path not accessible or missing control file: {env_path}")
     
     # Priority 2: Direct desktop mounts (primary for native deployment)
-    if os.path.exists("/media/pi"):
-        try:
-            media_items = os.listdir("/media/pi")
-            for item in media_items:
-                if item.startswith("PLAY_CARD"):
-                    mount_path = f"/media/pi/{item}"
-                    is_accessible, reason = is_usb_accessible(mount_path)
-                    control_file = os.path.join(mount_path, CONTROL_FILE_NAME)
+    try:
+        with os.scandir("/media/pi") as entries:
+            for entry in entries:
+                if entry.name.startswith("PLAY_CARD") and entry.is_dir():
+                    is_accessible, reason = is_usb_accessible(entry.path)
+                    control_file = os.path.join(entry.path, CONTROL_FILE_NAME)
                     if is_accessible and os.path.isfile(control_file):
-                        log_message(f"Control USB found at: {mount_path}")
-                        return mount_path
-                    else:
-                        log_message(f"Control USB issue: {mount_path} - {reason if not is_accessible else 'no control file'}")
-        except Exception as e:
-            log_message(f"Error scanning /media/pi for control USB: {e}")
+                        log_message(f"Control USB found at: {entry.path}")
+                        return entry.path
+                    elif USB_SCAN_DEBUG:
+                        log_message(f"Control USB issue: {entry.path} - {reason if not is_accessible else 'no control file'}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log_message(f"Error scanning /media/pi for control USB: {e}")
     
     # Priority 3: Check if control file is on music USB (fallback)
     music_usb = find_music_usb()
@@ -139,6 +281,8 @@ def find_control_usb_with_retry(max_retries=3, retry_delay=2):
         if attempt > 0:
             log_message(f"Retry {attempt} of {max_retries} for control USB detection...")
             time.sleep(retry_delay)
+            # A retry must rescan rather than reuse the cached miss
+            _usb_lookup_cache.pop('control', None)
         
         result = find_control_usb()
         if result:
@@ -148,18 +292,293 @@ def find_control_usb_with_retry(max_retries=3, retry_delay=2):
     log_message(f"Failed to find control USB after {max_retries} attempts")
     return None
 
+# How long a parsed /proc/self/mountinfo snapshot is reused
+MOUNT_CACHE_TTL = 1.0
+
+# (monotonic time of read, frozenset of mount points)
+_mount_cache = (0.0, frozenset())
+
+# mountinfo escapes space, tab, newline and backslash as \ooo
+_MOUNTINFO_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+def _unescape_mount_field(field):
+    """Decode a path field from /proc/self/mountinfo."""
+    return _MOUNTINFO_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), field)
+
+def get_mount_points():
+    """Return the set of current mount points, or None if mountinfo is unavailable."""
+    global _mount_cache
+    now = time.monotonic()
+    cached_at, mounts = _mount_cache
+    if now - cached_at < MOUNT_CACHE_TTL:
+        return mounts
+    
+    try:
+        with open('/proc/self/mountinfo') as f:
+            mounts = frozenset(
+                _unescape_mount_field(line.split()[4])
+                for line in f
+            )
+    except (OSError, IndexError):
+        return None
+    
+    _mount_cache = (now, mounts)
+    return mounts
+
+# udev's database of probed block devices, one file per device number
+UDEV_DATA_DIR = '/run/udev/data'
+
+def get_labelled_mounts():
+    """Return {mount point: filesystem label} for mounted block devices.
+
+    Labels come from the udev database, so drives are identified without
+    probing them. Mounts without a udev entry (e.g. FUSE filesystems) are
+    left out. Returns None if either mountinfo or the udev database is
+    unavailable.
+    """
+    if not os.path.isdir(UDEV_DATA_DIR):
+        return None
+    
+    labels = {}
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                fields = line.split()
+                try:
+                    with open(os.path.join(UDEV_DATA_DIR, 'b' + fields[2])) as db:
+                        for entry in db:
+                            if entry.startswith('E:ID_FS_LABEL='):
+                                label = entry[len('E:ID_FS_LABEL='):].rstrip('\n')
+                                labels[_unescape_mount_field(fields[4])] = label
+                                break
+                except OSError:
+                    continue
+    except (OSError, IndexError):
+        return None
+    return labels
+
+def get_mounted_devices():
+    """Return the device names (e.g. sda1) of mounted filesystems, or None."""
+    try:
+        with open('/proc/self/mountinfo') as f:
+            # The mount source follows the "-" separator and the fs type
+            return {
+                os.path.basename(fields[fields.index('-') + 2])
+                for fields in map(str.split, f)
+            }
+    except (OSError, ValueError, IndexError):
+        return None
+
 def usb_is_mounted(mount_path):
-    """Return True if mount_path is accessible and has content."""
-    is_accessible, reason = is_usb_accessible(mount_path)
-    log_message(f"USB mount check for {mount_path}: {reason}")
-    return is_accessible
+    """Return True if mount_path is a readable mount point."""
+    mounts = get_mount_points()
+    if mounts is None:
+        # No /proc (e.g. non-Linux development machine), probe the path directly
+        is_mounted = os.path.ismount(mount_path)
+    else:
+        is_mounted = os.path.normpath(mount_path) in mounts
+    # A constant-time permission check instead of listing the drive root
+    is_mounted = is_mounted and os.access(mount_path, os.R_OK)
+    if USB_SCAN_DEBUG:
+        log_message(f"USB mount check for {mount_path}: {'mounted' if is_mounted else 'not mounted'}")
+    return is_mounted
 
 def format_track_name(filename):
-    """Decode URL-encoded filename and return its basename without extension."""
-    decoded = unquote(filename)
-    base = os.path.basename(decoded)
-    base_without_ext, _ = os.path.splitext(base)
-    return base_without_ext
+    """Return a track path's basename without extension."""
+    base = filename.rpartition(os.sep)[2]
+    # Like splitext, a lone leading dot is part of the name, not an extension
+    name, _, _ = base.rpartition('.')
+    return name or base
+
+# Lowercase file extensions treated as playable audio
+AUDIO_EXTENSIONS = frozenset({'.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg'})
+
+# Folder levels below the drive root searched for albums (Artist/Album/Disc).
+# Both the index and the unindexed walk rank matches by (depth, name, path).
+ALBUM_SEARCH_DEPTH = 3
+
+class MusicIndex:
+    """In-memory index of album folders and audio files on the music USB.
+
+    Built with a single os.scandir walk when the music USB is mounted so that
+    album and track lookups don't re-walk the whole drive on every command.
+    """
+
+    def __init__(self):
+        self.root = None
+        # Held while (re)building so lookups wait for an in-progress walk
+        self._lock = threading.RLock()
+        # Root most recently requested with build_async(), None after clear()
+        self._wanted_root = None
+        # Per folder depth 1..ALBUM_SEARCH_DEPTH: (sorted lowercase folder
+        # names, matching paths)
+        self._albums = ()
+        # (sorted lowercase filenames, matching paths) for every audio file
+        self._tracks = ((), ())
+        # lowercase filename without extension -> paths, for exact track names
+        self._track_exact = {}
+
+    def build(self, root):
+        """Walk root once and replace the index contents."""
+        with self._lock:
+            albums = []
+            tracks = []
+            stack = [(root, 1)]
+            while stack:
+                path, depth = stack.pop()
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            # Skip hidden entries and macOS resource forks
+                            if entry.name.startswith('.'):
+                                continue
+                            if entry.is_dir(follow_symlinks=False):
+                                if depth <= ALBUM_SEARCH_DEPTH:
+                                    albums.append((depth, entry.name.lower(), entry.path))
+                                stack.append((entry.path, depth + 1))
+                            elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                                tracks.append((entry.name.lower(), entry.path))
+                except OSError as e:
+                    log_message(f"Error indexing music folder: {e}")
+            
+            albums.sort()
+            self._albums = tuple(
+                (tuple(name for d, name, _ in albums if d == depth),
+                 tuple(path for d, _, path in albums if d == depth))
+                for depth in range(1, ALBUM_SEARCH_DEPTH + 1)
+            )
+            tracks.sort()
+            track_exact = {}
+            for name, path in tracks:
+                track_exact.setdefault(os.path.splitext(name)[0], []).append(path)
+            self._tracks = (tuple(name for name, _ in tracks), tuple(path for _, path in tracks))
+            self._track_exact = track_exact
+            self.root = root
+            log_message(f"Indexed {len(albums)} folders and {len(tracks)} tracks in {root}")
+
+    def build_async(self, root):
+        """Index root on a background thread, e.g. right after it is mounted."""
+        self._wanted_root = root
+        threading.Thread(target=self._build_if_wanted, args=(root,), daemon=True).start()
+
+    def _build_if_wanted(self, root):
+        with self._lock:
+            # Skip if the drive was removed, or already indexed by ensure()
+            if self._wanted_root == root and self.root != root:
+                self.build(root)
+
+    def ensure(self, root):
+        """Build the index for root unless it is already indexed."""
+        with self._lock:
+            if self.root != root:
+                self.build(root)
+
+    def clear(self):
+        """Drop the index, e.g. when the music USB is removed."""
+        with self._lock:
+            self._wanted_root = None
+            self.root = None
+            self._albums = ()
+            self._tracks = ((), ())
+            self._track_exact = {}
+
+    def find_album(self, album_name):
+        """Return the shallowest folder whose name starts with album_name (case-insensitive).
+
+        Within a depth the smallest name wins, so an exact name beats longer ones.
+        """
+        key = album_name.lower()
+        for names, paths in self._albums:
+            i = bisect_left(names, key)
+            if i < len(names) and names[i].startswith(key):
+                return paths[i]
+        return None
+
+    def find_tracks_exact(self, track_name):
+        """Return paths of tracks named track_name, ignoring extension and case."""
+        return list(self._track_exact.get(track_name.lower(), ()))
+
+    def find_tracks_by_prefix(self, prefix):
+        """Return paths of tracks whose filename starts with prefix (case-insensitive)."""
+        names, paths = self._tracks
+        key = prefix.lower()
+        matches = []
+        i = bisect_left(names, key)
+        while i < len(names) and names[i].startswith(key):
+            matches.append(paths[i])
+            i += 1
+        return matches
+
+    def tracks(self):
+        """Return (lowercase filename, path) pairs for all indexed tracks."""
+        return zip(*self._tracks)
+
+# Shared index of the current music USB
+music_index = MusicIndex()
+
+def _scan_album_folder(root, album_name):
+    """Level-by-level scandir walk for the shallowest folder starting with album_name.
+
+    Matching is case-insensitive and ties within a level go to the smallest
+    (name, path), the same ranking as MusicIndex.find_album.
+    """
+    album_lower = album_name.lower()
+    level = [root]
+    for _ in range(ALBUM_SEARCH_DEPTH):
+        matches = []
+        next_level = []
+        for path in level:
+            try:
+                it = os.scandir(path)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                    except OSError:
+                        continue
+                    name = entry.name.lower()
+                    if name.startswith(album_lower):
+                        matches.append((name, entry.path))
+                    next_level.append(entry.path)
+        if matches:
+            return min(matches)[1]
+        level = next_level
+    return None
+
+# Album folders found by _scan_album_folder, most recently used last
+ALBUM_CACHE_SIZE = 128
+_album_cache = OrderedDict()
+_album_cache_lock = threading.Lock()
+
+def _find_album_cached(root, album_name, root_mtime):
+    """_scan_album_folder that remembers hits; root_mtime only invalidates the entry.
+
+    Misses are not cached because albums copied into nested folders don't
+    change the root's mtime, and a remembered hit is dropped once its folder
+    is gone.
+    """
+    key = (root, album_name, root_mtime)
+    with _album_cache_lock:
+        album_folder = _album_cache.get(key)
+        if album_folder:
+            _album_cache.move_to_end(key)
+    if album_folder and os.path.isdir(album_folder):
+        return album_folder
+    
+    album_folder = _scan_album_folder(root, album_name)
+    with _album_cache_lock:
+        if album_folder:
+            _album_cache[key] = album_folder
+            if len(_album_cache) > ALBUM_CACHE_SIZE:
+                _album_cache.popitem(last=False)
+        else:
+            _album_cache.pop(key, None)
+    return album_folder
 
 def find_album_folder(album_name, music_usb_path=None):
     """Recursively search for a folder whose name starts with album_name in the music USB."""
@@ -172,13 +591,24 @@ def find_album_folder(album_name, music_usb_path=None):
         return None
         
     log_message(f"Searching for album '{album_name}' in {music_usb_path}")
-    escaped_album = f"{glob.escape(album_name)}*"
-    pattern = os.path.join(music_usb_path, "**", escaped_album)
-    matching_dirs = glob.glob(pattern, recursive=True)
-    for d in matching_dirs:
-        if os.path.isdir(d):
-            log_message(f"Found album folder: {d}")
-            return d
+    if music_index.root == music_usb_path:
+        album_folder = music_index.find_album(album_name)
+        if album_folder:
+            log_message(f"Found album folder: {album_folder}")
+        else:
+            log_message(f"No album folder found matching '{album_name}'")
+        return album_folder
+    
+    # The drive root's mtime changes when albums are added, removed or the
+    # stick is swapped, so it invalidates remembered results
+    try:
+        root_mtime = os.stat(music_usb_path).st_mtime_ns
+    except OSError:
+        root_mtime = 0
+    album_folder = _find_album_cached(music_usb_path, album_name, root_mtime)
+    if album_folder:
+        log_message(f"Found album folder: {album_folder}")
+        return album_folder
     
     log_message(f"No album folder found matching '{album_name}'")
     return None
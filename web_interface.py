@@ -8,12 +8,12 @@ import os
 import base64
 import time
 import json
-import glob
-from urllib.parse import unquote
+from functools import lru_cache
+from urllib.request import url2pathname
 from flask import Flask, request, redirect, url_for, jsonify, send_from_directory
 from flask_cors import CORS
 from config import WEB_PORT, repeat_playback, CONTROL_FILE_NAME
-from utils import log_message, format_track_name, log_messages
+from utils import log_message, recent_log_messages
 
 # Try to import music tag libraries for metadata extraction
 try:
@@ -26,6 +26,35 @@ except ImportError:
     METADATA_SUPPORT = False
     log_message("Mutagen library not found. Album art extraction will be limited.")
 
+# Prefer a production WSGI server over Flask's development server
+try:
+    from waitress import serve
+    WAITRESS_SUPPORT = True
+except ImportError:
+    WAITRESS_SUPPORT = False
+
+# Common cover image filenames, checked in order in the album folder
+COVER_FILENAMES = (
+    'cover.jpg', 'cover.png', 'folder.jpg', 'folder.png',
+    'album.jpg', 'album.png', 'front.jpg', 'front.png',
+    'Cover.jpg', 'Cover.png', 'Folder.jpg', 'Folder.png',
+    'artwork.jpg', 'artwork.png', 'Artwork.jpg', 'Artwork.png',
+    'albumart.jpg', 'albumart.png', 'AlbumArt.jpg', 'AlbumArt.png'
+)
+
+# Extensions accepted when falling back to any image in the album folder
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif'})
+
+# The React build fingerprints everything under static/, so browsers may keep it
+STATIC_ASSET_MAX_AGE = 365 * 24 * 3600
+
+# Number of tracks (embedded art) and album folders (cover files) whose
+# encoded album art is kept between state polls
+ALBUM_ART_CACHE_SIZE = 16
+
+class _AlbumArtReadError(Exception):
+    """Album art could not be read; raised so the failure is not cached"""
+
 def create_app(music_player, usb_monitor):
     """Create Flask app with music player and USB monitor instances"""
     app = Flask(__name__, static_folder='frontend/build')
@@ -35,145 +64,154 @@ def create_app(music_player, usb_monitor):
     app.music_player = music_player
     app.usb_monitor = usb_monitor
 
-    def extract_album_art(file_path):
-        """Extract album art from audio file"""
+    def _decode_track_path(file_path):
+        """Only libvlc MRLs are percent-encoded; plain paths are used as-is"""
+        if file_path.startswith('file://'):
+            return url2pathname(file_path[7:])
+        return file_path
+
+    def _encode_image(image_data, img_type):
+        """Return image bytes as a data URI the frontend can display"""
+        return f"data:image/{img_type};base64,{base64.b64encode(image_data).decode('utf-8')}"
+
+    @lru_cache(maxsize=ALBUM_ART_CACHE_SIZE)
+    def _cached_embedded_art(track_path, track_mtime):
+        """Album art embedded in a track's tags; track_mtime only invalidates the entry"""
+        extension = os.path.splitext(track_path)[1].lower()
         try:
-            if not file_path or not os.path.exists(file_path):
-                return None
-            
-            # URL decode the file path if it's URL encoded
-            if file_path.startswith('file://'):
-                file_path = file_path[7:]
-                
-            decoded_file_path = unquote(file_path)
-            
-            if os.path.exists(decoded_file_path):
-                try:
-                    if decoded_file_path.lower().endswith('.mp3'):
-                        # Safer MP3 handling with better error catching
-                        try:
-                            audio = MP3(decoded_file_path)
-                            if audio.tags:
-                                for tag in audio.tags.values():
-                                    if hasattr(tag, 'FrameID') and tag.FrameID == 'APIC':  # ID3 picture frame
-                                        image_data = tag.data
-                                        return f"data:image/jpeg;base64,{base64.b64encode(image_data).decode('utf-8')}"
-                        except Exception as mp3_error:
-                            # Log specific MP3 errors but don't crash
-                            if "can't sync to MPEG frame" in str(mp3_error):
-                                log_message(f"MP3 sync error (corrupted file): {os.path.basename(decoded_file_path)}")
-                            else:
-                                log_message(f"MP3 metadata error: {str(mp3_error)}")
-                        
-                    elif decoded_file_path.lower().endswith('.flac'):
-                        try:
-                            audio = FLAC(decoded_file_path)
-                            if audio.pictures:
-                                picture = audio.pictures[0]
-                                image_data = picture.data
-                                return f"data:image/jpeg;base64,{base64.b64encode(image_data).decode('utf-8')}"
-                        except Exception as flac_error:
-                            log_message(f"FLAC metadata error: {str(flac_error)}")
-                            
-                except Exception as e:
-                    log_message(f"Error extracting metadata: {str(e)}")
+            if extension == '.mp3':
+                audio = MP3(track_path)
+                if audio.tags:
+                    for tag in audio.tags.values():
+                        if hasattr(tag, 'FrameID') and tag.FrameID == 'APIC':  # ID3 picture frame
+                            return _encode_image(tag.data, 'jpeg')
+            elif extension == '.flac':
+                audio = FLAC(track_path)
+                if audio.pictures:
+                    return _encode_image(audio.pictures[0].data, 'jpeg')
+        except Exception as e:
+            # Log specific MP3 errors but don't crash
+            if "can't sync to MPEG frame" in str(e):
+                log_message(f"MP3 sync error (corrupted file): {os.path.basename(track_path)}")
+            else:
+                log_message(f"Error extracting metadata: {str(e)}")
+            # Raising keeps lru_cache from remembering a failed read as "no art"
+            raise _AlbumArtReadError(track_path) from e
+        return None
+
+    @lru_cache(maxsize=ALBUM_ART_CACHE_SIZE)
+    def _cached_folder_art(album_dir, dir_mtime):
+        """Cover image from an album folder; dir_mtime only invalidates the entry"""
+        # List the folder once instead of probing every cover name with a stat
+        try:
+            with os.scandir(album_dir) as entries:
+                image_files = [
+                    entry.name for entry in entries
+                    if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS and entry.is_file()
+                ]
+        except Exception as e:
+            log_message(f"Error listing directory {album_dir}: {str(e)}")
+            raise _AlbumArtReadError(album_dir) from e
         
-            # If metadata extraction failed or not available, look for cover images in the album folder
-            album_dir = os.path.dirname(decoded_file_path)
-            
-            # Look for common cover image filenames
-            cover_filenames = ['cover.jpg', 'cover.png', 'folder.jpg', 'folder.png', 
-                               'album.jpg', 'album.png', 'front.jpg', 'front.png',
-                               'Cover.jpg', 'Cover.png', 'Folder.jpg', 'Folder.png',
-                               'artwork.jpg', 'artwork.png', 'Artwork.jpg', 'Artwork.png',
-                               'albumart.jpg', 'albumart.png', 'AlbumArt.jpg', 'AlbumArt.png']
-            
-            # First try exact matches
-            for cover_name in cover_filenames:
-                cover_path = os.path.join(album_dir, cover_name)
-                if os.path.exists(cover_path):
-                    try:
-                        with open(cover_path, 'rb') as img_file:
-                            img_data = img_file.read()
-                            img_type = cover_path.split('.')[-1].lower()
-                            return f"data:image/{img_type};base64,{base64.b64encode(img_data).decode('utf-8')}"
-                    except Exception as e:
-                        log_message(f"Error reading cover file: {str(e)}")
-            
-            # If no exact matches, look for any image file in the directory
+        # First try exact matches; USB drives are usually FAT, so ignore case
+        by_lower_name = {}
+        for file in image_files:
+            by_lower_name.setdefault(file.lower(), file)
+        candidates = []
+        for cover_name in COVER_FILENAMES:
+            file = by_lower_name.get(cover_name.lower())
+            if file and file not in candidates:
+                candidates.append(file)
+        
+        # If no exact matches, fall back to any image file in the directory
+        candidates.extend(file for file in image_files if file not in candidates)
+        
+        read_failed = False
+        for file in candidates:
+            cover_path = os.path.join(album_dir, file)
             try:
-                for file in os.listdir(album_dir):
-                    if file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                        cover_path = os.path.join(album_dir, file)
-                        try:
-                            with open(cover_path, 'rb') as img_file:
-                                img_data = img_file.read()
-                                img_type = cover_path.split('.')[-1].lower()
-                                if img_type == 'jpeg':
-                                    img_type = 'jpg'
-                                return f"data:image/{img_type};base64,{base64.b64encode(img_data).decode('utf-8')}"
-                        except Exception as e:
-                            log_message(f"Error reading image file {file}: {str(e)}")
+                with open(cover_path, 'rb') as img_file:
+                    img_data = img_file.read()
             except Exception as e:
-                log_message(f"Error listing directory {album_dir}: {str(e)}")
-        
-        except Exception as e:
-            log_message(f"Error processing file path: {str(e)}")
+                log_message(f"Error reading image file {file}: {str(e)}")
+                read_failed = True
+                continue
+            img_type = cover_path.split('.')[-1].lower()
+            if img_type == 'jpeg':
+                img_type = 'jpg'
+            return _encode_image(img_data, img_type)
         
+        if read_failed:
+            raise _AlbumArtReadError(album_dir)
         return None
 
+    def folder_art_for(album_dir):
+        """Cover image for an album folder, re-read only when the folder changes"""
+        try:
+            dir_mtime = os.stat(album_dir).st_mtime_ns
+            return _cached_folder_art(album_dir, dir_mtime)
+        except (OSError, _AlbumArtReadError):
+            return None
+
+    def album_art_for(file_path):
+        """Album art for a track: embedded art first, then the folder's cover"""
+        if not file_path:
+            return None
+        track_path = _decode_track_path(file_path)
+        
+        # Embedded art is the only thing worth caching per track
+        if METADATA_SUPPORT and os.path.splitext(track_path)[1].lower() in ('.mp3', '.flac'):
+            try:
+                track_mtime = os.stat(track_path).st_mtime_ns
+                image = _cached_embedded_art(track_path, track_mtime)
+                if image:
+                    return image
+            except (OSError, _AlbumArtReadError):
+                pass
+        
+        return folder_art_for(os.path.dirname(track_path))
+
     # API endpoints
     @app.route('/api/player_state')
     def get_player_state():
         """Get current player state and USB status"""
-        player = app.music_player
+        snap = app.music_player.snapshot()
+        album_state = snap.album_state
         usb_status = app.usb_monitor.get_current_usb_status()
         
-        current_vlc_track = player.get_current_media_title()
-        album_tracks = []
-        if player.current_album and player.current_album_tracks:
-            album_tracks = [format_track_name(track) for track in player.current_album_tracks]
+        # Display names are computed once when the album loads
+        album_tracks = album_state.track_names if album_state.album else ()
         
-        # Get current track path for album art extraction
-        current_track_path = None
+        # Get current track path for album art extraction; the player records
+        # every track it starts, so there is no need to ask libvlc for the MRL
+        current_track_path = snap.track_path
         album_dir = None
         
-        # First try to get the path from the player
-        if player.current_track_path:
-            current_track_path = player.current_track_path
-            album_dir = os.path.dirname(player.current_track_path)
-        elif player.current_album_folder:
+        if current_track_path:
+            album_dir = os.path.dirname(current_track_path)
+        elif album_state.folder:
             # If we have the album folder but not the specific track
-            album_dir = player.current_album_folder
-        elif player.current_album_tracks and player.media_player.get_media():
-            # Try to determine which track is currently playing
-            media_path = player.media_player.get_media().get_mrl()
-            if media_path.startswith('file://'):
-                media_path = media_path[7:]
-            current_track_path = media_path
+            album_dir = album_state.folder
         
         # Extract album art
         album_image = None
         if current_track_path:
-            album_image = extract_album_art(current_track_path)
+            album_image = album_art_for(current_track_path)
         elif album_dir:
             # If we only have the album directory, try to find any image in it
-            album_image = extract_album_art(os.path.join(album_dir, "dummy.mp3"))
-        
-        # Get playback position information
-        playback_info = player.get_playback_info()
+            album_image = folder_art_for(album_dir)
         
         return jsonify({
-            'currentAlbum': player.current_album,
-            'currentTrack': current_vlc_track,
+            'currentAlbum': album_state.album,
+            'currentTrack': snap.track_title,
             'albumTracks': album_tracks,
-            'volume': player.get_volume(),
-            'isPlaying': player.is_playing(),
+            'volume': snap.volume,
+            'isPlaying': snap.is_playing,
             'repeatPlayback': repeat_playback,
-            'logs': log_messages[-50:],
+            'logs': recent_log_messages(50),
             'albumImage': album_image,
-            'position': playback_info['position'],
-            'length': playback_info['length'],
+            'position': snap.position,
+            'length': snap.length,
             'usbStatus': {
                 'musicUsb': usb_status['music_usb'],
                 'controlUsb': usb_status['control_usb'],
@@ -229,9 +267,9 @@ def create_app(music_player, usb_monitor):
 
     @app.route('/api/set_volume/<int:volume>', methods=['POST'])
     def set_volume(volume):
-        """Set volume level"""
-        success = app.music_player.set_volume(volume)
-        return jsonify({'success': success})
+        """Set volume level; applied asynchronously, so report the accepted value"""
+        accepted = app.music_player.set_volume(volume)
+        return jsonify({'volume': accepted})
 
     @app.route('/health')
     def health_check():
@@ -249,9 +287,12 @@ def create_app(music_player, usb_monitor):
     def serve(path):
         """Serve static files"""
         if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
+            if path.startswith('static/'):
+                return send_from_directory(app.static_folder, path, max_age=STATIC_ASSET_MAX_AGE)
             return send_from_directory(app.static_folder, path)
         else:
-            return send_from_directory(app.static_folder, 'index.html')
+            # index.html names the current asset hashes, so always revalidate it
+            return send_from_directory(app.static_folder, 'index.html', max_age=0)
 
     @app.route('/write_control', methods=['POST'])
     def write_control():
@@ -323,7 +364,22 @@ def create_app(music_player, usb_monitor):
         return jsonify({
             'usb_monitor': usb_status,
             'music_player': player_status,
-            'logs': log_messages[-20:]
+            'logs': recent_log_messages(20)
         })
 
-    return app 
\ No newline at end of file
+    return app 
+
+def run_server(app, port=WEB_PORT):
+    """Serve the Flask app, using waitress when it is installed"""
+    if WAITRESS_SUPPORT:
+        log_message(f"Serving web interface with waitress on port {port}")
+        serve(app, host='0.0.0.0', port=port, threads=4, connection_limit=50)
+    else:
+        log_message("waitress not installed, falling back to Flask development server")
+        app.run(
+            host='0.0.0.0',
+            port=port,
+            debug=False,
+            threaded=True,
+            use_reloader=False  # Disable reloader to avoid double startup
+        )